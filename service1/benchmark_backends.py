@@ -0,0 +1,102 @@
+"""Compare service1 transcription backends side by side on a local clip.
+
+Every backend runs in its own process, so the reported peak RSS is that
+backend's alone: the resident set after loading the model and the peak while
+transcribing. Also reports the real-time factor (transcription time / audio
+duration, lower is faster) and, with a reference transcript, the word error
+rate.
+
+Usage:
+    python3 benchmark_backends.py clip.mp4 [--reference reference.txt] [--profile balanced]
+                                  [--backends whisper,ctranslate2] [--json]
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+import whisper
+from benchmark_profiles import word_error_rate
+from decoding_profiles import DECODING_PROFILES, DEFAULT_PROFILE, decode_options
+from transcription_backends import BACKENDS, backend_available, load_model
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_backend(backend, clip_path, profile, language):
+    """Runs in a fresh process; returns the measurements for one backend"""
+    audio = whisper.load_audio(clip_path)
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
+    model_name = DECODING_PROFILES[profile]['model']
+
+    start = time.time()
+    model = load_model(model_name, backend)
+    load_time = time.time() - start
+    rss_loaded = peak_rss_mb()
+
+    start = time.time()
+    result = model.transcribe(audio, verbose=None, **decode_options(profile, language))
+    elapsed = time.time() - start
+
+    return {
+        'backend': backend,
+        'model': model_name,
+        'duration': round(duration, 1),
+        'load_time': round(load_time, 2),
+        'transcribe_time': round(elapsed, 2),
+        'rtf': round(elapsed / duration, 3),
+        'rss_loaded_mb': round(rss_loaded),
+        'rss_peak_mb': round(peak_rss_mb()),
+        'segments': len(result['segments']),
+        'language': result.get('language'),
+        'text': result['text']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clip', help='reference audio/video clip')
+    parser.add_argument('--reference', help='text file with the reference transcript, enables WER')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, choices=list(DECODING_PROFILES),
+                        help=f'decoding profile for every backend (default: {DEFAULT_PROFILE})')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help='comma-separated backend names (default: all)')
+    parser.add_argument('--language', default=None, help='force a language instead of auto-detect')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(unknown)}")
+    missing = [b for b in backends if not backend_available(b)]
+    if missing:
+        parser.error(f"backends not installed: {', '.join(missing)}")
+
+    reference = None
+    if args.reference:
+        with open(args.reference, encoding='utf-8') as f:
+            reference = f.read()
+
+    # A fresh process per backend keeps one backend's memory out of the other's numbers
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for backend in backends:
+        with ctx.Pool(1) as pool:
+            r = pool.apply(run_backend, (backend, args.clip, args.profile, args.language))
+        text = r.pop('text')
+        r['wer'] = round(word_error_rate(reference, text), 3) if reference is not None else None
+        results.append(r)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'backend':<12} {'model':<8} {'load, s':>8} {'time, s':>9} {'RTF':>7} {'RSS, MB':>9} {'peak, MB':>9} {'WER':>7}")
+    for r in results:
+        wer = f"{r['wer']:>7.1%}" if r['wer'] is not None else f"{'-':>7}"
+        print(f"{r['backend']:<12} {r['model']:<8} {r['load_time']:>8.2f} {r['transcribe_time']:>9.2f} "
+              f"{r['rtf']:>7.3f} {r['rss_loaded_mb']:>9} {r['rss_peak_mb']:>9} {wer}")
+
+if __name__ == '__main__':
+    main()
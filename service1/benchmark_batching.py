@@ -0,0 +1,85 @@
+"""Measure cross-request batching under concurrent load.
+
+Runs the same clip as N concurrent transcriptions, once with every job calling
+Whisper on its own and once through service1's batching engine, and reports
+the wall time and the aggregate throughput (seconds of audio transcribed per
+second of wall time, higher is better). Run it inside the service1 container
+so the thread settings match the service's.
+
+Usage:
+    python3 benchmark_batching.py clip.mp4 [--jobs 2] [--profile balanced]
+                                  [--modes unbatched,batched] [--json]
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import whisper
+import service1
+from decoding_profiles import DECODING_PROFILES, DEFAULT_PROFILE, decode_options
+
+MODES = ('unbatched', 'batched')
+
+def run_mode(mode, model, audio, jobs, profile, language):
+    """Transcribe `jobs` copies of audio at once; returns the measurements"""
+    engine = None
+    if mode == 'batched':
+        engine = service1.BatchInferenceEngine(jobs, service1.BATCH_MAX_DELAY_MS / 1000)
+        model = engine.wrap(model)
+    options = decode_options(profile, language)
+
+    def transcribe(_):
+        return model.transcribe(audio, verbose=None, **options)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(transcribe, range(jobs)))
+    elapsed = time.time() - start
+
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
+    measurements = {
+        'mode': mode,
+        'jobs': jobs,
+        'wall_time': round(elapsed, 2),
+        'throughput': round(duration * jobs / elapsed, 2),
+        'segments': sum(len(r['segments']) for r in results)
+    }
+    if engine:
+        stats = engine.summary()
+        measurements.update(avg_batch=stats['avg_batch'], decoder_calls=stats['decoder_calls'])
+    return measurements
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clip', help='reference audio/video clip')
+    parser.add_argument('--jobs', type=int, default=service1.TRANSCRIBE_SLOTS,
+                        help=f'concurrent transcriptions (default: TRANSCRIBE_SLOTS, {service1.TRANSCRIBE_SLOTS})')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, choices=list(DECODING_PROFILES),
+                        help=f'decoding profile for every job (default: {DEFAULT_PROFILE})')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma-separated modes (default: all)')
+    parser.add_argument('--language', default=None, help='force a language instead of auto-detect')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    audio = whisper.load_audio(args.clip)
+    model = whisper.load_model(DECODING_PROFILES[args.profile]['model'])
+    results = [run_mode(mode, model, audio, args.jobs, args.profile, args.language) for mode in modes]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'mode':<10} {'jobs':>5} {'wall, s':>9} {'audio s/s':>10} {'avg batch':>10} {'decoder calls':>14}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['jobs']:>5} {r['wall_time']:>9.2f} {r['throughput']:>10.2f} "
+              f"{r.get('avg_batch', '-'):>10} {r.get('decoder_calls', '-'):>14}")
+
+if __name__ == '__main__':
+    main()
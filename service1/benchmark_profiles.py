@@ -0,0 +1,95 @@
+"""Benchmark service1 decoding profiles on a local reference clip.
+
+Reports the real-time factor (transcription time / audio duration, lower is
+faster) and the word error rate against a reference transcript for every
+profile in decoding_profiles.py.
+
+Usage:
+    python3 benchmark_profiles.py clip.mp4 reference.txt [--profiles fast,balanced] [--json]
+"""
+import argparse
+import json
+import re
+import time
+import whisper
+from decoding_profiles import DECODING_PROFILES, decode_options
+
+def normalize_words(text):
+    """Lowercase words without punctuation, so WER only counts real word errors"""
+    return re.findall(r"\w+(?:'\w+)?", text.lower())
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length"""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    prev = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            cur[j] = min(
+                prev[j] + 1,  # deletion
+                cur[j - 1] + 1,  # insertion
+                prev[j - 1] + (ref_word != hyp_word)  # substitution
+            )
+        prev = cur
+    return prev[-1] / len(ref)
+
+def benchmark(clip_path, reference, profiles, language=None):
+    audio = whisper.load_audio(clip_path)
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
+    models = {}
+    results = []
+
+    for name in profiles:
+        model_name = DECODING_PROFILES[name]['model']
+        if model_name not in models:
+            models[model_name] = whisper.load_model(model_name)
+        model = models[model_name]
+
+        start = time.time()
+        result = model.transcribe(audio, verbose=None, **decode_options(name, language))
+        elapsed = time.time() - start
+
+        results.append({
+            'profile': name,
+            'model': model_name,
+            'duration': round(duration, 1),
+            'transcribe_time': round(elapsed, 2),
+            'rtf': round(elapsed / duration, 3),
+            'wer': round(word_error_rate(reference, result['text']), 3)
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clip', help='reference audio/video clip')
+    parser.add_argument('reference', help='text file with the reference transcript')
+    parser.add_argument('--profiles', default=','.join(DECODING_PROFILES),
+                        help='comma-separated profile names (default: all)')
+    parser.add_argument('--language', default=None, help='force a language instead of auto-detect')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+    unknown = [p for p in profiles if p not in DECODING_PROFILES]
+    if unknown:
+        parser.error(f"unknown profiles: {', '.join(unknown)}")
+
+    with open(args.reference, encoding='utf-8') as f:
+        reference = f.read()
+
+    results = benchmark(args.clip, reference, profiles, args.language)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'profile':<10} {'model':<8} {'time, s':>9} {'RTF':>7} {'WER':>7}")
+    for r in results:
+        print(f"{r['profile']:<10} {r['model']:<8} {r['transcribe_time']:>9.2f} {r['rtf']:>7.3f} {r['wer']:>7.1%}")
+
+if __name__ == '__main__':
+    main()
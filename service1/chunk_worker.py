@@ -0,0 +1,22 @@
+"""Process pool worker for parallel chunked transcription in service1.
+
+Kept separate from service1.py so that the pool's tasks and initializer do not
+pull in the service. A spawned worker still re-imports the parent's __main__
+module as __mp_main__ before it runs them; the service is started through
+server.py, whose top level is empty, so that re-import costs nothing.
+"""
+import torch
+import whisper
+
+_model = None
+
+def init_worker(model_name, threads):
+    """Pool initializer - every worker process holds its own model"""
+    global _model
+    torch.set_num_threads(threads)
+    _model = whisper.load_model(model_name)
+
+def transcribe_chunk(index, audio, options):
+    """Transcribe one chunk of 16 kHz mono float32 audio"""
+    result = _model.transcribe(audio, verbose=None, **options)
+    return index, result
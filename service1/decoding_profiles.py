@@ -0,0 +1,80 @@
+"""Named Whisper decoding profiles for service1.
+
+A profile bundles the model with the decoding parameters that trade accuracy
+for speed. Requests pick one by name (`"profile": "fast"`) or let
+select_profile() choose from the measured duration of the source.
+"""
+
+# Whisper's default temperature fallback schedule
+FULL_FALLBACK = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+DECODING_PROFILES = {
+    # Greedy tiny, no fallback and no cross-window conditioning
+    'fast': {
+        'model': 'tiny',
+        'beam_size': None,
+        'best_of': None,
+        'temperature': 0.0,
+        'condition_on_previous_text': False,
+        'fp16': False
+    },
+    # Greedy base with a short fallback schedule
+    'balanced': {
+        'model': 'base',
+        'beam_size': None,
+        'best_of': 3,
+        'temperature': (0.0, 0.4, 0.8),
+        'condition_on_previous_text': True,
+        'fp16': False
+    },
+    # Beam search with the full fallback schedule
+    'accurate': {
+        'model': 'base',
+        'beam_size': 5,
+        'best_of': 5,
+        'temperature': FULL_FALLBACK,
+        'condition_on_previous_text': True,
+        'fp16': False
+    },
+    # Larger model, only loaded when a request asks for it
+    'quality': {
+        'model': 'small',
+        'beam_size': 5,
+        'best_of': 5,
+        'temperature': FULL_FALLBACK,
+        'condition_on_previous_text': True,
+        'fp16': False
+    }
+}
+
+DEFAULT_PROFILE = 'balanced'
+
+# (max duration in seconds, profile) - the first matching rule wins
+PROFILE_BY_DURATION = [
+    (300, 'accurate'),
+    (3600, 'balanced'),
+    (None, 'fast')
+]
+
+def select_profile(duration):
+    """Pick a profile name for a source of the given duration (0 = unknown)"""
+    if not duration:
+        return DEFAULT_PROFILE
+    for max_duration, name in PROFILE_BY_DURATION:
+        if max_duration is None or duration <= max_duration:
+            return name
+    return DEFAULT_PROFILE
+
+def decode_options(name, language=None, word_timestamps=False):
+    """Keyword arguments for model.transcribe() for the named profile"""
+    profile = DECODING_PROFILES[name]
+    return {
+        'task': 'transcribe',
+        'language': language,
+        'fp16': profile['fp16'],
+        'beam_size': profile['beam_size'],
+        'best_of': profile['best_of'],
+        'temperature': profile['temperature'],
+        'condition_on_previous_text': profile['condition_on_previous_text'],
+        'word_timestamps': word_timestamps
+    }
@@ -0,0 +1,11 @@
+"""Entry point for service1.
+
+Parallel chunked transcription runs in spawned processes, and every spawned
+process re-imports the __main__ module. With this module as __main__ that is
+a no-op, where service1.py would load Flask, yt-dlp and the service state in
+each worker.
+"""
+
+if __name__ == '__main__':
+    import service1
+    service1.main()
@@ -5,9 +5,35 @@ import subprocess
 import logging
 import whisper
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import uuid
 import re
+import threading
+import redis
+import socket
+import numpy as np
+import copy
+import yt_dlp
+from yt_dlp.cookies import YoutubeDLCookieJar
+import fcntl
+import shutil
+import sqlite3
+import gzip
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import queue
+import torch
+from whisper.transcribe import transcribe as whisper_transcribe
+from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+import chunk_worker
+from decoding_profiles import DECODING_PROFILES, DEFAULT_PROFILE, select_profile, decode_options
+from transcription_backends import BACKENDS, DEFAULT_BACKEND, BYTES_PER_PARAM, CT2Model, backend_available, load_model
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -17,22 +43,531 @@ app = Flask(__name__)
 # Create data directory
 os.makedirs('/data', exist_ok=True)
 
-# Load models
-logging.info("Loading Whisper models...")
-model_base = whisper.load_model("base")
-model_tiny = whisper.load_model("tiny")
-logging.info("Whisper models loaded successfully")
+# Job queue configuration
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
+TRANSCRIBE_WORKERS = int(os.environ.get('TRANSCRIBE_WORKERS', '2'))
+JOB_QUEUE_KEY = 'transcribe:queue'
+# A worker moves the job it runs onto its own processing list until the job
+# finishes; a restarted worker requeues what its list still holds
+JOB_PROCESSING_PREFIX = 'transcribe:processing:'
+WORKER_NAME = os.environ.get('WORKER_NAME', socket.gethostname())
+JOB_KEY_PREFIX = 'transcribe:job:'
+JOB_TTL = 7 * 24 * 3600  # keep finished jobs for a week
 
-def download_video(url, output_path):
-    """Download video from any platform"""
+# Single-flight: identical concurrent requests share one download + transcription
+FLIGHT_KEY_PREFIX = 'transcribe:flight:'
+FLIGHT_LEASE_SECONDS = 60  # leader renews this while it works; expiry means it died
+FLIGHT_RESULT_TTL = 300
+FLIGHT_IGNORED_OPTIONS = ('videoUrl', 'videoUrls', 'recordId')
+inflight = {}
+inflight_lock = threading.Lock()
+
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+# Streaming download -> transcription
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+STREAM_WINDOW_SECONDS = 30
+STREAM_MIN_ADVANCE_SECONDS = 5  # a window that would move on by less is committed whole
+STREAMING_DEFAULT = os.environ.get('STREAMING_DEFAULT', '0') == '1'
+
+# Batch ingest: how many items past the one being transcribed may be downloaded
+# ahead; bounds the disk used by a long batch
+BATCH_PREFETCH = int(os.environ.get('BATCH_PREFETCH', '2'))
+BATCH_MAX_PREFETCH = int(os.environ.get('BATCH_MAX_PREFETCH', '8'))
+
+# Ingest modes: 'video' downloads the MP4 up front, 'audio' fetches only the
+# best audio stream and downloads the video later via POST /video
+VIDEO_FORMAT = 'best[ext=mp4]/best'
+AUDIO_FORMAT = 'bestaudio[ext=m4a]/bestaudio/best'
+
+# Output-aware video selection. Shorts need the smaller side at no more than
+# 1080 px (service3 normalizes to 1080 high, crops 608x1080 and scales to
+# 1080x1920) and no more than 30 fps, so larger renditions are wasted bytes.
+# 'source' keeps the best available quality, e.g. for long-form uploads.
+FORMAT_TARGETS = {
+    'shorts': {'max_resolution': 1080, 'max_fps': 30},
+    'source': {}
+}
+FORMAT_TARGET_DEFAULT = os.environ.get('FORMAT_TARGET', 'shorts')
+CAPPED_VIDEO_FORMAT = 'bv*+ba/b'
+INGEST_DEFAULT = os.environ.get('INGEST_DEFAULT', 'video')
+INGESTS = ('video', 'audio')
+video_fetch_locks = {}
+video_fetch_locks_guard = threading.Lock()
+
+# Download engine: 'inprocess' uses yt-dlp's Python API with long-lived YoutubeDL
+# instances, 'subprocess' runs the yt-dlp binary per download
+DOWNLOAD_ENGINE = os.environ.get('DOWNLOAD_ENGINE', 'inprocess')
+DOWNLOAD_ENGINES = ('inprocess', 'subprocess')
+EXTRACT_INFO_TTL = int(os.environ.get('EXTRACT_INFO_TTL', '1800'))  # format URLs expire
+YTDL_POOL_SIZE = int(os.environ.get('YTDL_POOL_SIZE', '8'))  # idle instances kept per format
+COOKIES_FILE = '/cookies.txt'
+
+# Downloader used by the in-process engine: 'segmented' fetches progressive
+# http(s) formats over several ranged connections, 'ytdlp' uses yt-dlp's own
+DOWNLOADER = os.environ.get('DOWNLOADER', 'segmented')
+DOWNLOADERS = ('segmented', 'ytdlp')
+SEGMENT_BYTES = 8 * 1024 * 1024
+SEGMENTED_MIN_CONNECTIONS = int(os.environ.get('SEGMENTED_MIN_CONNECTIONS', '4'))
+SEGMENTED_MAX_CONNECTIONS = int(os.environ.get('SEGMENTED_MAX_CONNECTIONS', '16'))
+SEGMENT_RETRIES = 5
+PROGRESS_KEY_PREFIX = 'transcribe:progress:'
+YTDL_PARAMS = {
+    'nocheckcertificate': True,
+    'noplaylist': True,
+    'merge_output_format': 'mp4',
+    'http_headers': {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+    'retries': 10,
+    'fragment_retries': 10,
+    'concurrent_fragment_downloads': 4,
+    'buffersize': 16 * 1024,
+    'http_chunk_size': 10485760,
+    'no_warnings': True,
+    'quiet': True,
+    'noprogress': True,
+    'overwrites': True
+}
+
+# Download cache: index of already downloaded sources, evicted LRU above the byte budget
+DOWNLOAD_CACHE_INDEX = '/data/download_cache.json'
+DOWNLOAD_CACHE_BYTES = int(os.environ.get('DOWNLOAD_CACHE_BYTES', str(50 * 1024 ** 3)))
+TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'gclid', 'igshid', 'ref', 'pp', 'app'}
+source_info_memo = {}
+source_info_lock = threading.Lock()
+
+# Transcripts are persisted to /data so downstream services can take a handle
+# instead of the full whisper result inline
+TRANSCRIPTS_DIR = '/data/transcripts'
+TRANSCRIPT_FORMATS = ('full', 'slim', 'none')
+TRANSCRIPT_FORMAT_DEFAULT = os.environ.get('TRANSCRIPT_FORMAT_DEFAULT', 'full')
+WORD_SIDECAR_MAGIC = b'WRDS'
+WORD_SIDECAR_VERSION = 1
+# Full-text index of every transcript: one row per segment, times in milliseconds
+SEARCH_DB = '/data/transcripts/search.sqlite'
+SEARCH_MAX_LIMIT = 200
+# Decoded audio sidecar: written once at ingest, read by Whisper here and memory-mapped by service2
+LOUDNESS_WINDOW_SECONDS = 0.1
+
+# Transcript cache: gzipped whisper results keyed by file digest + model + decode options
+TRANSCRIPT_CACHE_DIR = '/data/transcripts/cache'
+os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+transcript_cache_stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'seconds_saved': 0.0}
+transcript_cache_lock = threading.Lock()
+file_digests = {}
+
+# Parallel transcription: split long audio at silences, decode chunks in a process pool
+PARALLEL_DEFAULT = os.environ.get('PARALLEL_DEFAULT', '1') == '1'
+PARALLEL_MIN_SECONDS = int(os.environ.get('PARALLEL_MIN_SECONDS', '900'))
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+PARALLEL_CHUNK_SECONDS = int(os.environ.get('PARALLEL_CHUNK_SECONDS', '300'))
+VAD_FRAME_SECONDS = 0.03
+VAD_SEARCH_SECONDS = 30  # look this far around each target boundary for a pause
+chunk_pools = {}
+chunk_pools_lock = threading.Lock()
+
+# Long transcriptions persist every finished chunk, so a restarted job resumes
+# from the last checkpoint instead of from the start
+CHECKPOINT_DIR = '/data/transcripts/checkpoints'
+CHECKPOINT_MIN_SECONDS = int(os.environ.get('CHECKPOINT_MIN_SECONDS', '1200'))
+CHECKPOINT_CHUNK_SECONDS = int(os.environ.get('CHECKPOINT_CHUNK_SECONDS', '600'))
+CHECKPOINT_PROMPT_CHARS = 1000  # whisper keeps at most 223 prompt tokens anyway
+os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+
+# Language is detected once per file on a short sample and remembered per channel
+LANGUAGE_SAMPLE_SECONDS = 30
+LANGUAGE_CACHE_KEY = 'transcribe:channel_language'
+LANGUAGE_CACHE_MIN_CONFIDENCE = float(os.environ.get('LANGUAGE_CACHE_MIN_CONFIDENCE', '0.8'))
+language_stats = {'detections': 0, 'detect_seconds': 0.0}
+language_stats_lock = threading.Lock()
+
+# Whisper models are loaded on first use (or warm-up) and kept within a RAM budget
+MODEL_MEMORY_MB = int(os.environ.get('MODEL_MEMORY_MB', '2048'))
+WARM_MODELS = [m for m in os.environ.get('WARM_MODELS', 'base,tiny').split(',') if m]
+# Parameter counts, used to make room before a model is loaded
+MODEL_PARAMS = {'tiny': 39e6, 'base': 74e6, 'small': 244e6, 'medium': 769e6, 'large': 1550e6}
+
+class ModelRegistry:
+    """Loads Whisper models lazily and unloads least recently used ones over budget.
     
-    # Use yt-dlp for everything
-    cmd = [
+    Models of non-default backends are registered as '<name>@<backend>'.
+    """
+    
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.models = OrderedDict()  # name -> entry, least recently used first
+        self.lock = threading.Lock()
+        self.load_locks = {}
+    
+    def get(self, name, backend='whisper'):
+        key = name if backend == 'whisper' else f"{name}@{backend}"
+        with self.lock:
+            entry = self.models.get(key)
+            if entry:
+                self.models.move_to_end(key)
+                entry['last_used'] = time.time()
+                return entry['model']
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+        
+        # Only one thread loads a given model, the others wait for it
+        with load_lock:
+            with self.lock:
+                entry = self.models.get(key)
+            if entry:
+                return self.get(name, backend)
+            
+            estimate = int(MODEL_PARAMS.get(name.split('.')[0], 0) * BYTES_PER_PARAM[backend])
+            with self.lock:
+                self._evict(estimate)
+            
+            logging.info(f"Loading Whisper model '{key}'...")
+            start = time.time()
+            model = load_model(name, backend, TORCH_THREADS_PER_JOB)
+            load_time = time.time() - start
+            if backend == 'whisper':
+                size = sum(p.numel() * p.element_size() for p in model.parameters())
+            else:
+                size = estimate  # CTranslate2 does not report its allocations
+            logging.info(f"Whisper model '{key}' loaded in {load_time:.1f}s ({size/1024/1024:.0f} MB)")
+            
+            with self.lock:
+                self.models[key] = {
+                    'model': model,
+                    'bytes': size,
+                    'load_time': load_time,
+                    'loaded_at': time.time(),
+                    'last_used': time.time()
+                }
+                self._evict(0, keep=key)
+            return model
+    
+    def _evict(self, incoming, keep=None):
+        """Drop least recently used models until `incoming` more bytes fit (lock held)"""
+        used = sum(e['bytes'] for e in self.models.values())
+        for name in list(self.models):
+            if used + incoming <= self.budget_bytes:
+                break
+            if name == keep:
+                continue
+            # Threads still transcribing keep their own reference until they finish
+            used -= self.models.pop(name)['bytes']
+            logging.info(f"Unloaded Whisper model '{name}' to stay within memory budget")
+    
+    def warm_up(self, names):
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                logging.error(f"Warm-up of model '{name}' failed: {e}")
+    
+    def status(self):
+        with self.lock:
+            return {
+                name: {
+                    'size_mb': round(e['bytes'] / 1024 / 1024, 1),
+                    'load_time': round(e['load_time'], 1),
+                    'loaded_at': e['loaded_at'],
+                    'last_used': e['last_used']
+                }
+                for name, e in self.models.items()
+            }
+    
+    def is_loaded(self, name):
+        with self.lock:
+            return name in self.models
+
+model_registry = ModelRegistry(MODEL_MEMORY_MB * 1024 * 1024)
+
+TRANSCRIBE_SLOTS = int(os.environ.get('TRANSCRIBE_SLOTS', '2'))
+
+# Cross-request batching of 30 s windows from all running transcriptions.
+# Every running job waits on one window at a time, so a batch never holds
+# more windows than there are transcription slots. Off by default until
+# benchmark_batching.py shows a gain on the deployed profiles.
+BATCH_INFERENCE = os.environ.get('BATCH_INFERENCE', '0') == '1'
+BATCH_SIZE = min(int(os.environ.get('BATCH_SIZE', str(TRANSCRIBE_SLOTS))), TRANSCRIBE_SLOTS)
+BATCH_MAX_DELAY_MS = int(os.environ.get('BATCH_MAX_DELAY_MS', '50'))
+# All batched Whisper compute runs on the engine's threads, not on the request
+# threads, so the encoder gets every core and each decoder thread its share
+BATCH_ENCODER_THREADS = int(os.environ.get('BATCH_ENCODER_THREADS', str(os.cpu_count() or 1)))
+BATCH_DECODER_THREADS = int(os.environ.get('BATCH_DECODER_THREADS', str(max(1, (os.cpu_count() or 1) // BATCH_SIZE))))
+
+class BatchInferenceEngine:
+    """Collects mel windows from concurrent jobs and decodes them in batches.
+    
+    The encoder runs once per batch for every window of the same model. The
+    decoder runs once per group of windows that share DecodingOptions. A job
+    that conditions on its own previous text carries that text as the prompt,
+    so its windows only share the encoder pass and form a group of their own;
+    groups decode in parallel on a pool of max_batch threads, so prompted jobs
+    still decode concurrently. Results are routed back to the waiting jobs
+    through futures.
+    
+    torch's thread count is set on each engine thread when it starts:
+    encoder_threads for the batching thread, decoder_threads for every
+    decoder thread.
+    """
+    
+    def __init__(self, max_batch, max_delay, encoder_threads=None, decoder_threads=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.encoder_threads = encoder_threads or os.cpu_count() or 1
+        self.decoder_threads = decoder_threads or max(1, (os.cpu_count() or 1) // max_batch)
+        self.requests = queue.Queue()
+        self.stats = {'batches': 0, 'windows': 0, 'largest_batch': 0, 'decoder_calls': 0, 'largest_decoder_batch': 0}
+        self.stats_lock = threading.Lock()
+        self.thread = None
+        self.decoders = None
+        self.thread_lock = threading.Lock()
+    
+    def wrap(self, model):
+        return BatchedModel(model, self)
+    
+    def decode(self, model, mel, options):
+        with self.thread_lock:
+            if self.thread is None:
+                self.decoders = ThreadPoolExecutor(max_workers=self.max_batch, thread_name_prefix='batch-decode',
+                                                   initializer=torch.set_num_threads,
+                                                   initargs=(self.decoder_threads,))
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        future = Future()
+        self.requests.put((model, mel, options, future))
+        return future.result()
+    
+    def _run(self):
+        torch.set_num_threads(self.encoder_threads)
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            by_model = {}
+            for item in batch:
+                by_model.setdefault(id(item[0]), []).append(item)
+            for items in by_model.values():
+                self._process(items)
+    
+    def _process(self, items):
+        model = items[0][0]
+        try:
+            with torch.no_grad():
+                mel = torch.stack([item[1] for item in items]).to(model.device)
+                features = model.embed_audio(mel.float())
+        except Exception as e:
+            for item in items:
+                item[3].set_exception(e)
+            return
+        
+        with self.stats_lock:
+            self.stats['batches'] += 1
+            self.stats['windows'] += len(items)
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(items))
+        
+        # DecodingOptions may hold the prompt as a token list, so group by repr.
+        # The engine thread moves on to the next batch while the groups decode.
+        groups = {}
+        for i, item in enumerate(items):
+            groups.setdefault(repr(item[2]), []).append(i)
+        for indexes in groups.values():
+            self.decoders.submit(self._decode_group, model, features[indexes], [items[i] for i in indexes])
+    
+    def _decode_group(self, model, features, group):
+        with self.stats_lock:
+            self.stats['decoder_calls'] += 1
+            self.stats['largest_decoder_batch'] = max(self.stats['largest_decoder_batch'], len(group))
+        options = group[0][2]
+        try:
+            with torch.no_grad():
+                if options.fp16:
+                    features = features.half()
+                # Audio features of shape (n_audio_ctx, n_audio_state) skip the encoder
+                for item, result in zip(group, model.decode(features, options)):
+                    item[3].set_result(result)
+        except Exception as e:
+            for item in group:
+                if not item[3].done():
+                    item[3].set_exception(e)
+    
+    def summary(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['avg_batch'] = round(stats['windows'] / stats['batches'], 2) if stats['batches'] else 0.0
+        stats['max_batch'] = self.max_batch
+        stats['encoder_threads'] = self.encoder_threads
+        stats['decoder_threads'] = self.decoder_threads
+        stats['pending'] = self.requests.qsize()
+        return stats
+
+class BatchedModel:
+    """Whisper model stand-in whose per-window decode goes through the batching engine"""
+    
+    def __init__(self, model, engine):
+        self._model = model
+        self._engine = engine
+    
+    def decode(self, mel, options):
+        if mel.ndim != 2:
+            return self._model.decode(mel, options)
+        return self._engine.decode(self._model, mel, options)
+    
+    def transcribe(self, audio, **kwargs):
+        return whisper_transcribe(self, audio, **kwargs)
+    
+    def __call__(self, *args, **kwargs):
+        return self._model(*args, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+batch_engine = BatchInferenceEngine(BATCH_SIZE, BATCH_MAX_DELAY_MS / 1000, BATCH_ENCODER_THREADS, BATCH_DECODER_THREADS)
+
+def get_model(name, batched=BATCH_INFERENCE, backend='whisper'):
+    """Resident model from the registry, wrapped for cross-request batching.
+    Batching works on whisper's decoder, other backends are returned as is."""
+    model = model_registry.get(name, backend)
+    return batch_engine.wrap(model) if batched and backend == 'whisper' else model
+
+# Execution pool: at most TRANSCRIBE_SLOTS transcriptions run at once, each
+# with its share of the CPU; at most QUEUE_LIMIT more requests may wait
+QUEUE_LIMIT = int(os.environ.get('QUEUE_LIMIT', '8'))
+TORCH_THREADS_PER_JOB = int(os.environ.get('TORCH_THREADS_PER_JOB', str(max(1, (os.cpu_count() or 1) // TRANSCRIBE_SLOTS))))
+DEFAULT_JOB_SECONDS = 120  # Retry-After estimate until real durations are measured
+
+class PoolFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Transcription queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class ExecutionPool:
+    """Admission control and concurrency limit for Whisper runs.
+    
+    Requests are admitted at the HTTP layer (admit) and take one of the fixed
+    slots only for the transcription itself (slot), so downloads do not hold
+    CPU slots. Queued jobs from the Redis workers skip admission - the Redis
+    list is their wait queue - but share the same slots.
+    """
+    
+    def __init__(self, slots, queue_limit):
+        self.slots = slots
+        self.queue_limit = queue_limit
+        self.cond = threading.Condition()
+        self.admitted = 0
+        self.running = 0
+        self.waiting = 0
+        self.durations = deque(maxlen=50)
+        self.rejected = 0
+    
+    def retry_after(self):
+        """Seconds until a queue place frees up, from measured slot durations"""
+        average = sum(self.durations) / len(self.durations) if self.durations else DEFAULT_JOB_SECONDS
+        # One slot frees every average/slots seconds
+        return max(1, int(average / self.slots + 0.5))
+    
+    def try_admit(self):
+        """Admit a request or raise PoolFull; pair with release()"""
+        with self.cond:
+            if self.waiting >= self.queue_limit or self.admitted >= self.slots + self.queue_limit:
+                self.rejected += 1
+                raise PoolFull(self.retry_after())
+            self.admitted += 1
+    
+    def release(self):
+        with self.cond:
+            self.admitted -= 1
+    
+    @contextmanager
+    def admit(self):
+        self.try_admit()
+        try:
+            yield
+        finally:
+            self.release()
+    
+    @contextmanager
+    def slot(self, job_id):
+        with self.cond:
+            if self.running >= self.slots:
+                logging.info(f"[{job_id}] Waiting for a transcription slot ({self.waiting} ahead)")
+            self.waiting += 1
+            try:
+                while self.running >= self.slots:
+                    self.cond.wait()
+            finally:
+                self.waiting -= 1
+            self.running += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running -= 1
+                self.durations.append(time.time() - start)
+                self.cond.notify()
+    
+    def summary(self):
+        with self.cond:
+            return {
+                'slots': self.slots,
+                'running': self.running,
+                'waiting_for_slot': self.waiting,
+                'admitted': self.admitted,
+                'queue_depth': self.waiting,
+                'queue_limit': self.queue_limit,
+                'rejected': self.rejected,
+                'torch_threads_per_job': TORCH_THREADS_PER_JOB,
+                'retry_after': self.retry_after()
+            }
+
+execution_pool = ExecutionPool(TRANSCRIBE_SLOTS, QUEUE_LIMIT)
+# Size torch for one job's share of the CPU so that concurrent slots do not
+# oversubscribe the cores; the batching engine's threads set their own counts
+torch.set_num_threads(TORCH_THREADS_PER_JOB)
+
+def video_format(options):
+    """Video format selection for a job: {'format', 'format_sort', 'target', 'label'}.
+    
+    Caps come from the named format_target and can be overridden per job with
+    max_resolution / max_fps. yt-dlp's 'res:N' sorts by the smaller side, so
+    vertical and horizontal sources are capped alike; if nothing is small
+    enough the smallest rendition is taken.
+    """
+    target = options.get('format_target') or FORMAT_TARGET_DEFAULT
+    caps = dict(FORMAT_TARGETS[target])
+    for key in ('max_resolution', 'max_fps'):
+        if options.get(key):
+            caps[key] = int(options[key])
+    if not caps:
+        return {'format': VIDEO_FORMAT, 'format_sort': None, 'target': target, 'label': 'video'}
+    
+    sort = []
+    if caps.get('max_resolution'):
+        sort.append(f"res:{caps['max_resolution']}")
+    if caps.get('max_fps'):
+        sort.append(f"fps:{caps['max_fps']}")
+    sort += ['ext:mp4:m4a', '+size']
+    label = f"video:{caps.get('max_resolution', 'best')}p{caps.get('max_fps', '')}"
+    return {'format': CAPPED_VIDEO_FORMAT, 'format_sort': sort, 'target': target, 'label': label}
+
+def format_summary(info):
+    """What yt-dlp actually picked, for the response metadata"""
+    return {key: info.get(key) for key in ('format_id', 'resolution', 'fps', 'vcodec', 'acodec', 'ext')}
+
+def build_download_cmd(url, output_path, fmt=VIDEO_FORMAT, format_sort=None):
+    """yt-dlp command line shared by the file and streaming downloaders"""
+    return [
         'yt-dlp',
         '--no-check-certificate',
         '-o', output_path,
         '--no-playlist',
-        '-f', 'best[ext=mp4]/best',
+        '-f', fmt,
+    ] + (['-S', ','.join(format_sort)] if format_sort else []) + [
         '--merge-output-format', 'mp4',
         '--cookies', '/cookies.txt',
         '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
@@ -47,17 +582,9 @@ def download_video(url, output_path):
         '--force-overwrites',
         url
     ]
-    
-    logging.info(f"Downloading from: {url}")
-    
-    # Run download
-    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=7200)  # 2 hour timeout
-    
-    if proc.returncode != 0:
-        logging.error(f"yt-dlp stderr: {proc.stderr}")
-        raise RuntimeError(f"Download failed: {proc.stderr}")
-    
-    # Verify file exists
+
+def check_downloaded_file(output_path):
+    """Verify the downloaded file exists and is not truncated, return its size"""
     if not os.path.exists(output_path):
         raise RuntimeError("Download completed but file not found")
     
@@ -68,94 +595,2237 @@ def download_video(url, output_path):
     logging.info(f"Download successful: {output_path} ({file_size/1024/1024:.2f} MB)")
     return file_size
 
+class SegmentedUnsupported(Exception):
+    """The source does not support ranged requests"""
+
+def segmented_download(media_url, headers, output_path, cookies=None, progress=None):
+    """Download a progressive http(s) file over parallel ranged connections.
+    
+    Starts with SEGMENTED_MIN_CONNECTIONS and adds connections while the
+    measured aggregate throughput keeps improving, up to
+    SEGMENTED_MAX_CONNECTIONS. Each segment is retried with backoff.
+    Returns telemetry for the response metadata.
+    """
+    probe = requests.get(media_url, headers=dict(headers, Range='bytes=0-0'),
+                         cookies=cookies, stream=True, timeout=30)
+    probe.close()
+    content_range = probe.headers.get('Content-Range', '')
+    if probe.status_code != 206 or '/' not in content_range or content_range.endswith('/*'):
+        raise SegmentedUnsupported(f"HTTP {probe.status_code}, Content-Range '{content_range}'")
+    total = int(content_range.rsplit('/', 1)[1])
+    
+    segments = queue.Queue()
+    for offset in range(0, total, SEGMENT_BYTES):
+        segments.put((offset, min(offset + SEGMENT_BYTES, total) - 1))
+    
+    fd = os.open(output_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644)
+    os.ftruncate(fd, total)
+    state = {'downloaded': 0, 'retries': 0, 'error': None}
+    state_lock = threading.Lock()
+    
+    def worker():
+        session = requests.Session()
+        session.headers.update(headers)
+        while state['error'] is None:
+            try:
+                start, end = segments.get_nowait()
+            except queue.Empty:
+                return
+            for attempt in range(SEGMENT_RETRIES):
+                written = 0
+                try:
+                    resp = session.get(media_url, headers={'Range': f'bytes={start}-{end}'},
+                                       cookies=cookies, stream=True, timeout=30)
+                    if resp.status_code != 206:
+                        raise IOError(f"HTTP {resp.status_code}")
+                    for chunk in resp.iter_content(256 * 1024):
+                        os.pwrite(fd, chunk, start + written)
+                        written += len(chunk)
+                        with state_lock:
+                            state['downloaded'] += len(chunk)
+                    if written != end - start + 1:
+                        raise IOError(f"short read {written}/{end - start + 1}")
+                    break
+                except (requests.RequestException, IOError) as e:
+                    with state_lock:
+                        state['downloaded'] -= written
+                        state['retries'] += 1
+                    logging.warning(f"Segment {start}-{end} attempt {attempt + 1} failed: {e}")
+                    time.sleep(min(2 ** attempt, 10))
+            else:
+                state['error'] = f"segment {start}-{end} failed after {SEGMENT_RETRIES} attempts"
+    
+    def spawn(n):
+        for _ in range(n):
+            thread = threading.Thread(target=worker, daemon=True)
+            thread.start()
+            threads.append(thread)
+    
+    threads = []
+    start_time = time.time()
+    spawn(SEGMENTED_MIN_CONNECTIONS)
+    
+    # Add connections while they still buy throughput
+    best_rate = 0
+    growing = True
+    last_bytes, last_time = 0, start_time
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+            now = time.time()
+            rate = (state['downloaded'] - last_bytes) / (now - last_time)
+            last_bytes, last_time = state['downloaded'], now
+            if progress:
+                progress({'status': 'downloading', 'downloaded_bytes': state['downloaded'],
+                          'total_bytes': total, 'speed': rate,
+                          'eta': (total - state['downloaded']) / rate if rate else None})
+            if not growing or segments.empty():
+                continue
+            if rate > best_rate * 1.1:
+                best_rate = rate
+                if len(threads) < SEGMENTED_MAX_CONNECTIONS:
+                    spawn(min(2, SEGMENTED_MAX_CONNECTIONS - len(threads)))
+            else:
+                growing = False  # throughput plateaued, more connections will not help
+    finally:
+        os.close(fd)
+    
+    if state['error']:
+        raise RuntimeError(f"Segmented download failed: {state['error']}")
+    if progress:
+        progress({'status': 'finished', 'downloaded_bytes': total, 'total_bytes': total})
+    
+    return {
+        'downloader': 'segmented',
+        'connections': len(threads),
+        'connections_start': SEGMENTED_MIN_CONNECTIONS,
+        'segments': (total + SEGMENT_BYTES - 1) // SEGMENT_BYTES,
+        'retries': state['retries'],
+        'peak_bytes_per_sec': int(best_rate)
+    }
+
+class YtDlpEngine:
+    """In-process yt-dlp downloads.
+    
+    Long-lived YoutubeDL instances are pooled per format (yt-dlp builds the
+    format selector at construction) and checked out by one thread at a time,
+    so short-lived Flask request threads reuse them too. Each instance carries
+    its own progress hook state, set by the thread that checked it out and read
+    from whichever thread yt-dlp reports progress on (fragment downloads run on
+    worker threads). All of them share one cookie jar. Raw extractor results
+    are cached per normalized URL for EXTRACT_INFO_TTL, so retries skip the
+    page/API fetches and go straight to format selection and download.
+    """
+    
+    def __init__(self, info_ttl):
+        self.info_ttl = info_ttl
+        self.idle = {}  # (format, format_sort) -> idle (YoutubeDL, progress hook state)
+        self.info_cache = {}  # normalized url -> (expires, raw info)
+        self.lock = threading.Lock()
+        self.cookie_jar = None
+        self.stats = {'info_hits': 0, 'info_misses': 0, 'instances_created': 0}
+    
+    def _cookies(self):
+        with self.lock:
+            if self.cookie_jar is None and os.path.exists(COOKIES_FILE):
+                self.cookie_jar = YoutubeDLCookieJar(COOKIES_FILE)
+                self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
+            return self.cookie_jar
+    
+    @contextmanager
+    def _ydl(self, fmt, format_sort=None):
+        """Check out (YoutubeDL, hook state) for fmt from the pool, creating one
+        if none is idle. hook['progress'] receives the instance's progress."""
+        key = (fmt, tuple(format_sort or ()))
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            entry = idle.pop() if idle else None
+        if entry is None:
+            hook = {'progress': None}
+            
+            def on_progress(status):
+                callback = hook['progress']
+                if callback:
+                    callback(status)
+            
+            params = copy.deepcopy(YTDL_PARAMS)
+            params.update({'format': fmt, 'progress_hooks': [on_progress]})
+            if format_sort:
+                params['format_sort'] = list(format_sort)
+            ydl = yt_dlp.YoutubeDL(params)
+            jar = self._cookies()
+            if jar is not None:
+                ydl.cookiejar = jar
+            with self.lock:
+                self.stats['instances_created'] += 1
+            entry = (ydl, hook)
+        try:
+            yield entry
+        finally:
+            entry[1]['progress'] = None
+            with self.lock:
+                if len(idle) < YTDL_POOL_SIZE:
+                    idle.append(entry)
+    
+    def extract(self, url):
+        """Raw (unprocessed) extractor result, from the TTL cache when fresh"""
+        key = normalize_url(url)
+        with self.lock:
+            cached = self.info_cache.get(key)
+            if cached and cached[0] > time.time():
+                self.stats['info_hits'] += 1
+                return copy.deepcopy(cached[1])
+            self.stats['info_misses'] += 1
+        
+        with self._ydl(VIDEO_FORMAT) as (ydl, _):
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False, process=False))
+        with self.lock:
+            if len(self.info_cache) > 1000:
+                now = time.time()
+                self.info_cache = {k: v for k, v in self.info_cache.items() if v[0] > now}
+            self.info_cache[key] = (time.time() + self.info_ttl, info)
+        return copy.deepcopy(info)
+    
+    def download(self, url, output_path, fmt, progress=None, downloader=DOWNLOADER, format_sort=None):
+        """Download url to output_path, returns downloader telemetry"""
+        info = self.extract(url)
+        with self._ydl(fmt, format_sort) as (ydl, hook):
+            if downloader == 'segmented':
+                # Only progressive single-file http(s) formats can be fetched by byte ranges
+                selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+                if (not selected.get('requested_formats') and selected.get('url')
+                        and selected.get('protocol') in ('http', 'https')):
+                    try:
+                        telemetry = segmented_download(selected['url'], selected.get('http_headers') or {},
+                                                       output_path, self._cookies(), progress)
+                        telemetry['format'] = format_summary(selected)
+                        return telemetry
+                    except SegmentedUnsupported as e:
+                        logging.info(f"Ranged download not supported ({e}), using yt-dlp")
+                else:
+                    logging.info(f"Format protocol {selected.get('protocol')} is not progressive, using yt-dlp")
+            
+            ydl.params['outtmpl']['default'] = output_path
+            hook['progress'] = progress
+            processed = ydl.process_ie_result(info, download=True)
+            return {'downloader': 'ytdlp', 'format': format_summary(processed)}
+    
+    def summary(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['cached_urls'] = len(self.info_cache)
+            stats['idle_instances'] = sum(len(v) for v in self.idle.values())
+        return stats
+
+ytdl_engine = YtDlpEngine(EXTRACT_INFO_TTL)
+
+def progress_recorder(job_id):
+    """yt-dlp progress hook that publishes live progress for job_id (at most once a second)"""
+    last = {'at': 0}
+    
+    def record(status):
+        now = time.time()
+        if status.get('status') == 'downloading' and now - last['at'] < 1:
+            return
+        last['at'] = now
+        progress = {
+            'status': status.get('status'),
+            'downloaded_bytes': status.get('downloaded_bytes'),
+            'total_bytes': status.get('total_bytes') or status.get('total_bytes_estimate'),
+            'speed': status.get('speed'),
+            'eta': status.get('eta'),
+            'fragment_index': status.get('fragment_index'),
+            'fragment_count': status.get('fragment_count'),
+            'updated': now
+        }
+        try:
+            redis_client.set(f"{PROGRESS_KEY_PREFIX}{job_id}", json.dumps(progress), ex=3600)
+        except redis.RedisError:
+            pass
+    
+    return record
+
+def download_video(url, output_path, fmt=VIDEO_FORMAT, job_id=None, engine=None, downloader=None, stats=None,
+                   format_sort=None):
+    """Download video from any platform.
+    
+    Returns the file size; if a `stats` dict is given it is filled with
+    throughput telemetry (bytes/s, connections, retries) and the chosen format.
+    """
+    engine = engine or DOWNLOAD_ENGINE
+    logging.info(f"Downloading from: {url} ({engine})")
+    start_time = time.time()
+    
+    if engine == 'inprocess':
+        try:
+            telemetry = ytdl_engine.download(url, output_path, fmt, progress_recorder(job_id) if job_id else None,
+                                             downloader or DOWNLOADER, format_sort)
+        except yt_dlp.utils.DownloadError as e:
+            logging.error(f"yt-dlp error: {e}")
+            raise RuntimeError(f"Download failed: {e}")
+    else:
+        # Use yt-dlp for everything
+        cmd = build_download_cmd(url, output_path, fmt, format_sort)
+        # Report the chosen format once the file is in place
+        cmd[-1:-1] = ['--print', 'after_move:%(format_id)s|%(resolution)s|%(fps)s|%(vcodec)s|%(acodec)s|%(ext)s']
+        
+        # Run download
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=7200)  # 2 hour timeout
+        
+        if proc.returncode != 0:
+            logging.error(f"yt-dlp stderr: {proc.stderr}")
+            raise RuntimeError(f"Download failed: {proc.stderr}")
+        telemetry = {'downloader': 'subprocess'}
+        printed = proc.stdout.strip().splitlines()
+        if printed and printed[-1].count('|') == 5:
+            values = [None if v in ('NA', 'none') else v for v in printed[-1].split('|')]
+            telemetry['format'] = dict(zip(('format_id', 'resolution', 'fps', 'vcodec', 'acodec', 'ext'), values))
+    
+    file_size = check_downloaded_file(output_path)
+    if stats is not None:
+        elapsed = max(time.time() - start_time, 1e-6)
+        stats.update(telemetry)
+        stats.update({'bytes': file_size, 'seconds': round(elapsed, 1), 'bytes_per_sec': int(file_size / elapsed)})
+    return file_size
+
+class PCMStream:
+    """16 kHz mono s16le audio produced by ffmpeg while the download is running"""
+    
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.buffer = bytearray()
+        self.base = 0  # sample index of buffer[0]
+        self.eof = False
+    
+    def append(self, data):
+        with self.cond:
+            self.buffer.extend(data)
+            self.cond.notify_all()
+    
+    def close(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+    
+    def available(self):
+        return self.base + len(self.buffer) // 2
+    
+    def wait_for(self, sample):
+        """Block until audio up to `sample` has arrived or the stream ended"""
+        with self.cond:
+            while not self.eof and self.available() < sample:
+                self.cond.wait(timeout=1)
+            return self.available(), self.eof
+    
+    def read(self, start, end):
+        """Return float32 samples [start, end) and drop everything before start"""
+        with self.cond:
+            drop = (start - self.base) * 2
+            if drop > 0:
+                del self.buffer[:drop]
+                self.base = start
+            raw = bytes(self.buffer[:(end - start) * 2])
+        return np.frombuffer(raw, np.int16).astype(np.float32) / 32768.0
+
+def shift_segment(seg, offset, segment_id):
+    """Copy of a segment (and its words) moved `offset` seconds along the timeline"""
+    seg = dict(seg)
+    seg['id'] = segment_id
+    seg['start'] = round(seg['start'] + offset, 3)
+    seg['end'] = round(seg['end'] + offset, 3)
+    if 'words' in seg:
+        seg['words'] = [
+            dict(w, start=round(w['start'] + offset, 3), end=round(w['end'] + offset, 3))
+            for w in seg['words']
+        ]
+    return seg
+
+def decode_windows(pcm, model, job_id, on_segment=None, **decode_options):
+    """Transcribe a PCMStream window by window as the audio arrives.
+    
+    The last segment of each window is only provisional: decoding of the next
+    window restarts at its start so no words are cut at window boundaries.
+    Finished segments are passed to on_segment as soon as they are final.
+    
+    Returns (segments, language, seconds until the first window was available).
+    """
+    window = STREAM_WINDOW_SECONDS * SAMPLE_RATE
+    segments = []
+    committed = 0
+    language = decode_options.pop('language', None)
+    first_audio_at = None
+    start = time.time()
+    
+    while True:
+        available, eof = pcm.wait_for(committed + window)
+        if available <= committed:
+            break
+        if first_audio_at is None:
+            first_audio_at = time.time() - start
+        
+        # One window at a time, even when more is buffered (local files, sidecars,
+        # or a download running ahead), so segments are emitted as they finish
+        end = min(available, committed + window)
+        last_window = eof and end >= available
+        audio = pcm.read(committed, end)
+        # Condition on the previous windows only where the profile does
+        prompt = None
+        if decode_options.get('condition_on_previous_text', True):
+            prompt = ''.join(seg['text'] for seg in segments[-3:]) or None
+        result = model.transcribe(audio, language=language, initial_prompt=prompt, **decode_options)
+        language = language or result.get('language')
+        
+        window_segments = result['segments']
+        tail_start = window_segments[-1]['start'] if window_segments else 0
+        if not last_window and len(window_segments) > 1 and tail_start >= STREAM_MIN_ADVANCE_SECONDS:
+            # Keep the last segment for the next window, it may be cut mid-word.
+            # A tail near the window start (e.g. zero-length segments in silence)
+            # would re-decode almost the same window again, so it is committed.
+            window_segments = window_segments[:-1]
+            advance = int(tail_start * SAMPLE_RATE)
+        else:
+            advance = end - committed
+        
+        offset = committed / SAMPLE_RATE
+        for seg in window_segments:
+            seg = shift_segment(seg, offset, len(segments))
+            segments.append(seg)
+            if on_segment:
+                on_segment(seg)
+        
+        committed += advance
+        logging.info(f"[{job_id}] Streamed transcription up to {committed / SAMPLE_RATE:.0f}s")
+    
+    return segments, language, first_audio_at
+
+def stream_transcribe(url, output_path, model, job_id, fmt=VIDEO_FORMAT, format_sort=None, on_segment=None, **decode_options):
+    """Download and transcribe concurrently.
+    
+    yt-dlp writes the source to stdout; a tee thread saves it to `output_path`
+    (service2 still needs the MP4) and feeds ffmpeg, which emits 16 kHz mono PCM
+    that decode_windows() transcribes while the download continues.
+    
+    Returns (result, stats) where result has the usual whisper shape.
+    """
+    pcm = PCMStream()
+    
+    ytdlp = subprocess.Popen(build_download_cmd(url, '-', fmt, format_sort), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ffmpeg = subprocess.Popen([
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-i', 'pipe:0',
+        '-vn', '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+        'pipe:1'
+    ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    def tee():
+        with open(output_path, 'wb') as f:
+            while True:
+                chunk = ytdlp.stdout.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+                try:
+                    ffmpeg.stdin.write(chunk)
+                except (BrokenPipeError, ValueError):
+                    pass  # ffmpeg gave up (e.g. moov atom at the end), keep saving the file
+        try:
+            ffmpeg.stdin.close()
+        except BrokenPipeError:
+            pass
+    
+    tee_thread = threading.Thread(target=tee, daemon=True)
+    tee_thread.start()
+    start_pcm_reader(ffmpeg, pcm)
+    
+    try:
+        segments, language, first_audio_at = decode_windows(pcm, model, job_id, on_segment, **decode_options)
+    except BaseException:
+        # Stop the download before the caller removes the file the tee is writing
+        ytdlp.kill()
+        ffmpeg.kill()
+        raise
+    finally:
+        tee_thread.join()
+        ytdlp.wait()
+        ffmpeg.wait()
+    
+    if ytdlp.returncode != 0:
+        stderr = ytdlp.stderr.read().decode(errors='replace')
+        logging.error(f"yt-dlp stderr: {stderr}")
+        raise RuntimeError(f"Download failed: {stderr}")
+    
+    stats = {'streamed': True, 'first_audio_after': round(first_audio_at or 0, 1)}
+    if not segments and ffmpeg.returncode != 0:
+        # Container was not streamable, transcribe the saved file instead
+        logging.warning(f"[{job_id}] Source not streamable, falling back to file transcription")
+        decode_options['language'] = language
+        result = model.transcribe(output_path, **decode_options)
+        if on_segment:
+            for seg in result['segments']:
+                on_segment(seg)
+        return result, {'streamed': False, 'fallback': 'not_streamable'}
+    
+    return {
+        'text': ''.join(seg['text'] for seg in segments),
+        'segments': segments,
+        'language': language
+    }, stats
+
+def start_pcm_reader(ffmpeg, pcm):
+    """Move ffmpeg's PCM output into a PCMStream on a background thread"""
+    def read_pcm():
+        while True:
+            chunk = ffmpeg.stdout.read(SAMPLE_RATE * 2)
+            if not chunk:
+                break
+            pcm.append(chunk)
+        pcm.close()
+    
+    thread = threading.Thread(target=read_pcm, daemon=True)
+    thread.start()
+    return thread
+
+def windowed_file_transcribe(path, model, job_id, on_segment, **decode_options):
+    """Transcribe a local file window by window so segments can be emitted early"""
+    pcm = PCMStream()
+    pcm_path, _ = audio_sidecar_paths(path)
+    if os.path.exists(pcm_path):
+        # Already decoded at ingest
+        pcm.append(np.load(pcm_path, mmap_mode='r').tobytes())
+        pcm.close()
+        segments, language, _ = decode_windows(pcm, model, job_id, on_segment, **decode_options)
+        return {
+            'text': ''.join(seg['text'] for seg in segments),
+            'segments': segments,
+            'language': language
+        }
+    
+    ffmpeg = subprocess.Popen([
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-i', path,
+        '-vn', '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+        'pipe:1'
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    start_pcm_reader(ffmpeg, pcm)
+    
+    try:
+        segments, language, _ = decode_windows(pcm, model, job_id, on_segment, **decode_options)
+    finally:
+        ffmpeg.kill()
+        ffmpeg.wait()
+    return {
+        'text': ''.join(seg['text'] for seg in segments),
+        'segments': segments,
+        'language': language
+    }
+
+def normalize_url(url):
+    """Canonical form of a source URL so retries and share links map to one key"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    path = parts.path.rstrip('/')
+    query = [(k, v) for k, v in parse_qsl(parts.query)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+    
+    # YouTube share forms -> watch?v=<id>
+    if host == 'youtu.be' and path:
+        host, query = 'youtube.com', [('v', path.lstrip('/'))]
+        path = '/watch'
+    elif host == 'youtube.com' and path.startswith(('/shorts/', '/live/')):
+        query = [('v', path.split('/')[2])]
+        path = '/watch'
+    if host == 'youtube.com' and path == '/watch':
+        query = [(k, v) for k, v in query if k == 'v']
+    
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+def resolve_source_info(url):
+    """Ask yt-dlp for extractor:id and channel id without downloading.
+    
+    Memoized per normalized URL; fields are None when yt-dlp cannot tell.
+    """
+    memo_key = normalize_url(url)
+    with source_info_lock:
+        if memo_key in source_info_memo:
+            return source_info_memo[memo_key]
+    
+    info = {'video_id': None, 'channel_id': None}
+    if DOWNLOAD_ENGINE == 'inprocess':
+        try:
+            raw = ytdl_engine.extract(url)
+        except yt_dlp.utils.YoutubeDLError as e:
+            logging.warning(f"Metadata extraction failed for {url}: {e}")
+            return info
+        info = {
+            'video_id': f"{raw['extractor_key']}:{raw['id']}" if raw.get('id') else None,
+            'channel_id': raw.get('channel_id') or raw.get('uploader_id')
+        }
+        with source_info_lock:
+            if len(source_info_memo) > 10000:
+                source_info_memo.clear()
+            source_info_memo[memo_key] = info
+        return info
+    
+    cmd = [
+        'yt-dlp', '--no-check-certificate', '--no-playlist', '--no-warnings',
+        '--cookies', '/cookies.txt',
+        '--skip-download', '--print', '%(extractor_key)s:%(id)s\t%(channel_id,uploader_id|)s',
+        url
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+    except subprocess.TimeoutExpired:
+        return info
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        return info
+    
+    video_id, _, channel_id = lines[-1].strip().partition('\t')
+    info = {'video_id': video_id or None, 'channel_id': channel_id or None}
+    with source_info_lock:
+        if len(source_info_memo) > 10000:
+            source_info_memo.clear()
+        source_info_memo[memo_key] = info
+    return info
+
+@contextmanager
+def download_cache_index():
+    """Locked read-modify-write access to the cache index shared on /data"""
+    with open(DOWNLOAD_CACHE_INDEX + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(DOWNLOAD_CACHE_INDEX) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {'entries': {}, 'aliases': {}}
+        
+        yield index
+        
+        tmp_path = DOWNLOAD_CACHE_INDEX + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, DOWNLOAD_CACHE_INDEX)
+
+def _cache_entry(index, key):
+    """Return a still-valid entry and mark it used, dropping stale ones"""
+    entry = index['entries'].get(key)
+    if not entry:
+        return None
+    if not os.path.exists(entry['path']) or os.path.getsize(entry['path']) != entry['size']:
+        del index['entries'][key]
+        return None
+    entry['last_used'] = time.time()
+    entry['hits'] = entry.get('hits', 0) + 1
+    return dict(entry)
+
+def download_cache_lookup(url, kind):
+    """Look up a download by normalized URL, then by extractor video id.
+    
+    Returns (entry or None, cache key to store a fresh download under).
+    """
+    url_key = f"{kind}:{normalize_url(url)}"
+    with download_cache_index() as index:
+        key = index['aliases'].get(url_key)
+        entry = _cache_entry(index, key) if key else None
+    if entry:
+        return entry, key
+    
+    video_id = resolve_source_info(url)['video_id']
+    if not video_id:
+        return None, url_key
+    
+    key = f"{kind}:{video_id}"
+    with download_cache_index() as index:
+        entry = _cache_entry(index, key)
+        if entry:
+            index['aliases'][url_key] = key
+    return entry, key
+
+def cache_entry_bytes(entry):
+    """Disk used by a cached source together with its sidecars"""
+    return entry['size'] + sum(os.path.getsize(p) for p in audio_sidecar_paths(entry['path']) if os.path.exists(p))
+
+def download_cache_store(url, kind, key, path):
+    """Record a finished download and evict least recently used entries over budget"""
+    size = os.path.getsize(path)
+    # Only what an earlier lookup already resolved, never run yt-dlp under the index lock
+    with source_info_lock:
+        channel_id = source_info_memo.get(normalize_url(url), {}).get('channel_id')
+    with download_cache_index() as index:
+        entries = index['entries']
+        entries[key] = {
+            'path': path,
+            'size': size,
+            'url': url,
+            'channel_id': channel_id,
+            'created': time.time(),
+            'last_used': time.time(),
+            'hits': 0
+        }
+        index['aliases'][f"{kind}:{normalize_url(url)}"] = key
+        
+        # Sidecars are written after the source, so they are counted from disk
+        sizes = {k: cache_entry_bytes(e) for k, e in entries.items()}
+        total = sum(sizes.values())
+        for old_key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= DOWNLOAD_CACHE_BYTES:
+                break
+            if old_key == key:
+                continue
+            old = entries.pop(old_key)
+            total -= sizes[old_key]
+            for stale in (old['path'],) + audio_sidecar_paths(old['path']):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            logging.info(f"Download cache evicted {old['path']} ({sizes[old_key]/1024/1024:.1f} MB with sidecars)")
+        
+        index['aliases'] = {a: k for a, k in index['aliases'].items() if k in entries}
+
+def slim_segments(result):
+    """start/end/text only - everything clip scoring and subtitles need"""
+    return [
+        {'start': round(seg['start'], 3), 'end': round(seg['end'], 3), 'text': seg['text']}
+        for seg in result.get('segments', [])
+    ]
+
+def word_sidecar_path(transcript_id):
+    return os.path.join(TRANSCRIPTS_DIR, f"{transcript_id}.words.bin")
+
+def write_word_sidecar(result, transcript_id):
+    """Store word timings as a columnar binary sidecar next to the transcript.
+    
+    Keyed by transcript rather than by source: a cached source is shared by
+    every job that transcribes it, with or without the same options.
+    
+    Layout (little endian, every section 4-byte aligned so it can be memory-mapped):
+        header   b'WRDS', uint32 version, uint32 word count N, uint32 text bytes
+        start    float32[N]  seconds, ascending
+        end      float32[N]
+        offsets  uint32[N + 1] byte offsets of each word in the text blob
+        text     utf-8 blob
+    """
+    words = [w for seg in result.get('segments', []) for w in seg.get('words', [])]
+    encoded = [w['word'].encode('utf-8') for w in words]
+    offsets = np.zeros(len(words) + 1, dtype='<u4')
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = b''.join(encoded)
+    
+    path = word_sidecar_path(transcript_id)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(WORD_SIDECAR_MAGIC)
+        f.write(np.array([WORD_SIDECAR_VERSION, len(words), len(blob)], dtype='<u4').tobytes())
+        f.write(np.array([w['start'] for w in words], dtype='<f4').tobytes())
+        f.write(np.array([w['end'] for w in words], dtype='<f4').tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return {'path': path, 'words': len(words)}
+
+def audio_sidecar_paths(media_path):
+    """(PCM, loudness envelope) sidecar paths next to a media file"""
+    stem = os.path.splitext(media_path)[0]
+    return stem + '.pcm.npy', stem + '.loudness.npy'
+
+def loudness_envelope(samples, window=int(LOUDNESS_WINDOW_SECONDS * SAMPLE_RATE)):
+    """RMS level in dBFS of every `window` samples of int16 PCM"""
+    n_windows = -(-len(samples) // window)
+    envelope = np.empty(n_windows, dtype=np.float32)
+    block = 6000  # windows per block, ~10 minutes, keeps the float copy small
+    for first in range(0, n_windows, block):
+        chunk = samples[first * window:(first + block) * window].astype(np.float32) / 32768.0
+        count = -(-len(chunk) // window)
+        chunk = np.pad(chunk, (0, count * window - len(chunk)))
+        rms = np.sqrt(np.mean(chunk.reshape(count, window) ** 2, axis=1))
+        envelope[first:first + count] = 20 * np.log10(np.maximum(rms, 1e-5))
+    return envelope
+
+def audio_sidecar_fresh(media_path):
+    """Whether both audio sidecars exist and are newer than the media file"""
+    return all(os.path.exists(p) and os.path.getmtime(p) >= os.path.getmtime(media_path)
+               for p in audio_sidecar_paths(media_path))
+
+def write_audio_sidecar(media_path):
+    """Decode the audio track once to 16 kHz mono int16 PCM plus its loudness
+    envelope, both as .npy arrays next to the media file so they can be
+    memory-mapped. Kept if already newer than the media file."""
+    pcm_path, loudness_path = audio_sidecar_paths(media_path)
+    if audio_sidecar_fresh(media_path):
+        samples = np.load(pcm_path, mmap_mode='r')
+    else:
+        out = subprocess.run([
+            'ffmpeg', '-nostdin', '-loglevel', 'error',
+            '-i', media_path,
+            '-vn', '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+            '-'
+        ], capture_output=True, check=True).stdout
+        samples = np.frombuffer(out, np.int16)
+        for path, array in ((pcm_path, samples), (loudness_path, loudness_envelope(samples))):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+    return {
+        'pcm_path': pcm_path,
+        'loudness_path': loudness_path,
+        'sample_rate': SAMPLE_RATE,
+        'loudness_window': LOUDNESS_WINDOW_SECONDS,
+        'duration': round(len(samples) / SAMPLE_RATE, 3)
+    }
+
+def ensure_audio_sidecar(media_path, job_id):
+    """write_audio_sidecar() that never fails the job (e.g. a source without audio)"""
+    try:
+        return write_audio_sidecar(media_path)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.warning(f"[{job_id}] Could not write audio sidecar: {e}")
+        return None
+
+def load_audio(path):
+    """16 kHz mono float32 samples of a media file, from its PCM sidecar if present"""
+    pcm_path, _ = audio_sidecar_paths(path)
+    if os.path.exists(pcm_path):
+        return np.load(pcm_path, mmap_mode='r').astype(np.float32) / 32768.0
+    return whisper.load_audio(path)
+
+def transcript_path(transcript_id):
+    return os.path.join(TRANSCRIPTS_DIR, f"{transcript_id}.json.gz")
+
+def save_transcript(transcript_id, result, words_path=None):
+    """Persist a compact, columnar copy of the transcript and return its handle"""
+    segments = result.get('segments', [])
+    compact = {
+        'version': 1,
+        'id': transcript_id,
+        'language': result.get('language'),
+        'text': result['text'],
+        'start': [round(seg['start'], 3) for seg in segments],
+        'end': [round(seg['end'], 3) for seg in segments],
+        'segments': [seg['text'] for seg in segments],
+        'words_path': words_path
+    }
+    path = transcript_path(transcript_id)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(compact, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return {'id': transcript_id, 'path': path, 'segments': len(segments)}
+
+def search_db():
+    """Connection to the transcript index; SQLite connections are per thread"""
+    conn = sqlite3.connect(SEARCH_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS videos (
+            video_key TEXT PRIMARY KEY,
+            video_id TEXT,
+            url TEXT,
+            transcript_id TEXT,
+            language TEXT,
+            duration_ms INTEGER,
+            indexed_at REAL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS segments USING fts5(
+            text,
+            video_key UNINDEXED,
+            start_ms UNINDEXED,
+            end_ms UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+    """)
+    return conn
+
+def index_transcript(transcript_id, url, result):
+    """Add (or replace) a video's segments in the full-text index"""
+    video_key = normalize_url(url)
+    # Only what is already known; indexing must not trigger a metadata request
+    with source_info_lock:
+        video_id = source_info_memo.get(video_key, {}).get('video_id')
+    segments = result.get('segments', [])
+    
+    conn = search_db()
+    try:
+        with conn:
+            conn.execute('DELETE FROM segments WHERE video_key = ?', (video_key,))
+            conn.executemany(
+                'INSERT INTO segments (text, video_key, start_ms, end_ms) VALUES (?, ?, ?, ?)',
+                [(seg['text'].strip(), video_key, int(seg['start'] * 1000), int(seg['end'] * 1000)) for seg in segments]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (video_key, video_id, url, transcript_id, result.get('language'),
+                 int(segments[-1]['end'] * 1000) if segments else 0, time.time())
+            )
+    finally:
+        conn.close()
+    return {'video_key': video_key, 'segments': len(segments)}
+
+def fts_query(text, phrase=False):
+    """Plain user text as an FTS5 expression: every word must match (or the exact phrase)"""
+    words = re.findall(r'\w+', text, re.UNICODE)
+    if not words:
+        return None
+    if phrase:
+        return '"' + ' '.join(words) + '"'
+    return ' '.join(f'"{w}"' for w in words)
+
+def search_transcripts(query, limit=20, video_key=None, phrase=False):
+    match = fts_query(query, phrase)
+    if not match:
+        return []
+    sql = """
+        SELECT s.video_key, s.start_ms, s.end_ms, s.text,
+               snippet(segments, 0, '[', ']', '…', 12) AS snippet,
+               bm25(segments) AS rank,
+               v.video_id, v.url, v.transcript_id, v.language
+        FROM segments s JOIN videos v ON v.video_key = s.video_key
+        WHERE segments MATCH ?
+    """
+    params = [match]
+    if video_key:
+        sql += ' AND s.video_key = ?'
+        params.append(video_key)
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    
+    conn = search_db()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            'video_key': row['video_key'],
+            'video_id': row['video_id'],
+            'url': row['url'],
+            'transcript_id': row['transcript_id'],
+            'language': row['language'],
+            'start_ms': row['start_ms'],
+            'end_ms': row['end_ms'],
+            'text': row['text'],
+            'snippet': row['snippet'],
+            'score': round(-row['rank'], 3)  # bm25 is lower for better matches
+        }
+        for row in rows
+    ]
+
+def file_digest(path):
+    """Streaming SHA-256 of a file, memoized by path, size and mtime"""
+    st = os.stat(path)
+    memo_key = (path, st.st_size, st.st_mtime)
+    if memo_key in file_digests:
+        return file_digests[memo_key]
+    
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    file_digests[memo_key] = h.hexdigest()
+    return file_digests[memo_key]
+
+def transcript_cache_key(digest, model_name, decode_options):
+    payload = json.dumps({'sha256': digest, 'model': model_name, 'options': decode_options}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def transcript_cache_path(key):
+    return os.path.join(TRANSCRIPT_CACHE_DIR, f"{key}.json.gz")
+
+def transcript_cache_get(key, file_size):
+    """Return the cached entry for key (and count the hit or miss)"""
+    try:
+        with gzip.open(transcript_cache_path(key), 'rt', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (FileNotFoundError, OSError, ValueError):
+        entry = None
+    
+    with transcript_cache_lock:
+        if entry:
+            transcript_cache_stats['hits'] += 1
+            transcript_cache_stats['bytes_saved'] += file_size
+            transcript_cache_stats['seconds_saved'] += entry.get('transcribe_time', 0)
+        else:
+            transcript_cache_stats['misses'] += 1
+    return entry
+
+def transcript_cache_put(key, result, transcribe_time):
+    tmp_path = transcript_cache_path(key) + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump({'result': result, 'transcribe_time': transcribe_time, 'created': time.time()}, f)
+    os.replace(tmp_path, transcript_cache_path(key))
+
+def transcript_cache_summary():
+    with transcript_cache_lock:
+        stats = dict(transcript_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    stats['seconds_saved'] = round(stats['seconds_saved'], 1)
+    return stats
+
+def probe_duration(path):
+    """Media duration in seconds via ffprobe, 0 if unknown"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'json', path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        return float(json.loads(result.stdout)['format']['duration'])
+    except Exception as e:
+        logging.error(f"Error probing duration of {path}: {e}")
+        return 0
+
+def detect_language(model, audio):
+    """Detect the spoken language from the first 30 s of audio"""
+    if isinstance(model, CT2Model):
+        return model.detect_language(audio[:30 * SAMPLE_RATE])
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio[:30 * SAMPLE_RATE])).to(model.device)
+    _, probs = model.detect_language(mel)
+    language = max(probs, key=probs.get)
+    return language, float(probs[language])
+
+def normalize_language(language):
+    """Language code for a hint given as code or name ('ru', 'Russian'), None if absent"""
+    if not language:
+        return None
+    language = language.lower()
+    if language in LANGUAGES:
+        return language
+    if language in TO_LANGUAGE_CODE:
+        return TO_LANGUAGE_CODE[language]
+    raise ValueError(f"Unsupported language '{language}'")
+
+def load_audio_sample(path, start, seconds):
+    """Decode only [start, start + seconds) of a file to 16 kHz mono float32"""
+    pcm_path, _ = audio_sidecar_paths(path)
+    if os.path.exists(pcm_path):
+        samples = np.load(pcm_path, mmap_mode='r')
+        first = int(start * SAMPLE_RATE)
+        return samples[first:first + int(seconds * SAMPLE_RATE)].astype(np.float32) / 32768.0
+    cmd = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-ss', str(start), '-t', str(seconds),
+        '-i', path,
+        '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-'
+    ]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+def channel_language(channel_id):
+    """Language previously detected for a channel, None if unknown"""
+    if not channel_id:
+        return None
+    try:
+        cached = redis_client.hget(LANGUAGE_CACHE_KEY, channel_id)
+    except redis.RedisError as e:
+        logging.warning(f"Channel language cache unavailable: {e}")
+        return None
+    return json.loads(cached) if cached else None
+
+def remember_channel_language(channel_id, language, confidence):
+    if not channel_id or confidence < LANGUAGE_CACHE_MIN_CONFIDENCE:
+        return
+    try:
+        redis_client.hset(LANGUAGE_CACHE_KEY, channel_id, json.dumps({
+            'language': language,
+            'confidence': round(confidence, 3),
+            'updated': time.time()
+        }))
+    except redis.RedisError as e:
+        logging.warning(f"Channel language cache unavailable: {e}")
+
+def average_detect_time():
+    with language_stats_lock:
+        if not language_stats['detections']:
+            return 0.0
+        return language_stats['detect_seconds'] / language_stats['detections']
+
+def resolve_language(path, model, duration, hint, channel_id, job_id):
+    """Language for the whole file: explicit hint, then the channel's known
+    language, then one detection on a short sample. Returns (language, info)."""
+    if hint:
+        return hint, {'language': hint, 'confidence': None, 'source': 'hint'}
+    
+    known = channel_language(channel_id)
+    if known:
+        logging.info(f"[{job_id}] Using language '{known['language']}' known for channel {channel_id}")
+        return known['language'], {'language': known['language'], 'confidence': known['confidence'], 'source': 'channel'}
+    
+    # Skip a possible intro (music, silence) when the source is long enough
+    start = min(duration * 0.1, 60) if duration > 2 * LANGUAGE_SAMPLE_SECONDS else 0
+    detect_start = time.time()
+    sample = load_audio_sample(path, start, LANGUAGE_SAMPLE_SECONDS)
+    language, confidence = detect_language(model, sample)
+    detect_time = time.time() - detect_start
+    
+    with language_stats_lock:
+        language_stats['detections'] += 1
+        language_stats['detect_seconds'] += detect_time
+    remember_channel_language(channel_id, language, confidence)
+    logging.info(f"[{job_id}] Detected language '{language}' ({confidence:.2f}) in {detect_time:.1f}s")
+    
+    return language, {
+        'language': language,
+        'confidence': round(confidence, 3),
+        'source': 'detected',
+        'detect_time': round(detect_time, 2)
+    }
+
+def find_silence_splits(audio, chunk_seconds=PARALLEL_CHUNK_SECONDS):
+    """Energy-based voice activity pass: cut roughly every chunk_seconds at the
+    quietest point nearby, return a list of (start, end) sample ranges"""
+    frame = int(VAD_FRAME_SECONDS * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return [(0, len(audio))]
+    energy = np.sqrt(np.mean(audio[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+    # Smooth over ~300 ms so cuts land in real pauses, not between syllables
+    energy = np.convolve(energy, np.ones(10) / 10, mode='same')
+    
+    frames_per_second = 1 / VAD_FRAME_SECONDS
+    search = int(VAD_SEARCH_SECONDS * frames_per_second)
+    chunk = int(chunk_seconds * frames_per_second)
+    
+    splits = [0]
+    target = chunk
+    while target < n_frames - chunk // 2:
+        lo, hi = max(splits[-1] + 1, target - search), min(n_frames, target + search)
+        cut = lo + int(np.argmin(energy[lo:hi]))
+        splits.append(cut)
+        target = cut + chunk
+    
+    bounds = [s * frame for s in splits] + [len(audio)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def get_chunk_pool(model_name):
+    """Long-lived process pool whose workers each hold their own copy of model_name.
+    
+    Spawned workers re-import the __main__ module, so start the service
+    through server.py to keep them from importing all of service1.py.
+    """
+    with chunk_pools_lock:
+        pool = chunk_pools.get(model_name)
+        if pool is None:
+            threads = max(1, (os.cpu_count() or 1) // PARALLEL_WORKERS)
+            logging.info(f"Starting {PARALLEL_WORKERS} transcription processes ({model_name}, {threads} threads each)")
+            pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=chunk_worker.init_worker,
+                initargs=(model_name, threads)
+            )
+            chunk_pools[model_name] = pool
+        return pool
+
+class TranscriptionCheckpoint:
+    """Finished chunks of one long transcription, under CHECKPOINT_DIR/<key>/.
+    
+    state.json records how the audio was split and, for sequential decoding,
+    the prompt that carries the decoder's context into the next chunk. Every
+    finished chunk's result is written to chunk-<i>.json.gz as it completes.
+    The key is the transcript cache key, so a resubmission of the same file
+    with the same model and options finds the checkpoint of the earlier run.
+    """
+    
+    def __init__(self, key, mode, split):
+        self.dir = os.path.join(CHECKPOINT_DIR, key)
+        self.state = None
+        try:
+            with open(os.path.join(self.dir, 'state.json')) as f:
+                self.state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        if self.state and self.state['mode'] != mode:
+            self.clear()
+            self.state = None
+        if not self.state:
+            os.makedirs(self.dir, exist_ok=True)
+            self.state = {'mode': mode, 'chunks': split(), 'prompt': '', 'created': time.time()}
+            self._write_state()
+        self.chunks = [tuple(c) for c in self.state['chunks']]
+    
+    @property
+    def prompt(self):
+        return self.state['prompt']
+    
+    def _chunk_path(self, index):
+        return os.path.join(self.dir, f"chunk-{index}.json.gz")
+    
+    def _write_state(self):
+        tmp_path = os.path.join(self.dir, 'state.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, os.path.join(self.dir, 'state.json'))
+    
+    def load_done(self):
+        """{index: result} of the chunks finished by earlier runs"""
+        done = {}
+        for index in range(len(self.chunks)):
+            try:
+                with gzip.open(self._chunk_path(index), 'rt', encoding='utf-8') as f:
+                    done[index] = json.load(f)
+            except (FileNotFoundError, OSError, ValueError):
+                continue
+        return done
+    
+    def save(self, index, result, prompt=None):
+        tmp_path = self._chunk_path(index) + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self._chunk_path(index))
+        if prompt is not None:
+            self.state['prompt'] = prompt
+            self._write_state()
+    
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def clear_checkpoint(key):
+    shutil.rmtree(os.path.join(CHECKPOINT_DIR, key), ignore_errors=True)
+
+def stitch_chunks(chunks, results, language):
+    """Join per-chunk results into one, with segments shifted to the full
+    timeline and continuous ids, in the shape of model.transcribe()"""
+    segments = []
+    for i, (start, _) in enumerate(chunks):
+        offset = start / SAMPLE_RATE
+        for seg in results[i]['segments']:
+            seg = shift_segment(seg, offset, len(segments))
+            seg['seek'] = seg.get('seek', 0) + start // whisper.audio.HOP_LENGTH
+            segments.append(seg)
+    
+    return {
+        'text': ''.join(results[i]['text'] for i in range(len(chunks))),
+        'segments': segments,
+        'language': language
+    }
+
+def parallel_transcribe(path, model, model_name, job_id, checkpoint_key=None, **decode_options):
+    """Split audio at silences and transcribe the chunks concurrently.
+    
+    Segments are stitched back with offsets shifted to the full timeline and
+    continuous ids, so the result has the same shape as model.transcribe().
+    With checkpoint_key, finished chunks are persisted and skipped on resume.
+    """
+    audio = load_audio(path)
+    
+    # One language for all chunks, otherwise each chunk guesses on its own
+    options = dict(decode_options)
+    if not options.get('language'):
+        options['language'], _ = detect_language(model, audio)
+    
+    checkpoint = None
+    results = {}
+    if checkpoint_key:
+        checkpoint = TranscriptionCheckpoint(checkpoint_key, 'parallel', lambda: find_silence_splits(audio))
+        chunks = checkpoint.chunks
+        results = checkpoint.load_done()
+        if results:
+            logging.info(f"[{job_id}] Resuming from checkpoint: {len(results)}/{len(chunks)} chunks done")
+    else:
+        chunks = find_silence_splits(audio)
+    resumed = len(results)
+    
+    logging.info(f"[{job_id}] Parallel transcription: {len(chunks)} chunks on {PARALLEL_WORKERS} workers")
+    pool = get_chunk_pool(model_name)
+    try:
+        futures = [pool.submit(chunk_worker.transcribe_chunk, i, audio[start:end], options)
+                   for i, (start, end) in enumerate(chunks) if i not in results]
+        for future in as_completed(futures):
+            index, result = future.result()
+            results[index] = result
+            if checkpoint:
+                checkpoint.save(index, result)
+    except BrokenProcessPool:
+        with chunk_pools_lock:
+            chunk_pools.pop(model_name, None)
+        raise
+    
+    info = {'chunks': len(chunks), 'workers': PARALLEL_WORKERS}
+    if checkpoint:
+        info['resumed_chunks'] = resumed
+    return stitch_chunks(chunks, results, options['language']), info
+
+def carry_prompt(result, previous):
+    """Decoder context for the next chunk, like whisper's own prompt between windows"""
+    segments = result['segments']
+    if not segments:
+        return previous  # nothing said, keep the earlier context
+    if segments[-1].get('temperature', 0.0) > 0.5:
+        return ''  # whisper drops the prompt after a high-temperature fallback
+    return (previous + ''.join(seg['text'] for seg in segments))[-CHECKPOINT_PROMPT_CHARS:]
+
+def checkpointed_transcribe(path, model, job_id, checkpoint_key, on_segment=None, **decode_options):
+    """Transcribe a long file chunk after chunk, persisting each finished
+    chunk and the prompt that continues it, so a rerun picks up at the first
+    unfinished chunk instead of offset zero"""
+    audio = load_audio(path)
+    checkpoint = TranscriptionCheckpoint(checkpoint_key, 'sequential',
+                                         lambda: find_silence_splits(audio, CHECKPOINT_CHUNK_SECONDS))
+    chunks = checkpoint.chunks
+    results = checkpoint.load_done()
+    resumed = 0
+    while resumed in results:
+        resumed += 1
+    if resumed:
+        logging.info(f"[{job_id}] Resuming from checkpoint: {resumed}/{len(chunks)} chunks done")
+    
+    segment_id = 0
+    for i, (start, end) in enumerate(chunks):
+        if i >= resumed:
+            options = dict(decode_options)
+            if options.get('condition_on_previous_text', True) and checkpoint.prompt:
+                options['initial_prompt'] = checkpoint.prompt
+            results[i] = model.transcribe(audio[start:end], verbose=None, **options)
+            checkpoint.save(i, results[i], prompt=carry_prompt(results[i], checkpoint.prompt))
+            logging.info(f"[{job_id}] Checkpointed chunk {i + 1}/{len(chunks)}")
+        if on_segment:
+            for seg in results[i]['segments']:
+                on_segment(shift_segment(seg, start / SAMPLE_RATE, segment_id))
+                segment_id += 1
+    
+    language = decode_options.get('language') or (results[0].get('language') if results else None)
+    return stitch_chunks(chunks, results, language), {'chunks': len(chunks), 'resumed_chunks': resumed}
+
+def manifest_path(job_id):
+    return f"/data/{job_id}.source.json"
+
+def write_manifest(job_id, url, **fields):
+    """Remember where a job's media came from so the video can be fetched later"""
+    manifest = {'job_id': job_id, 'url': url, 'video_path': f"/data/{job_id}.mp4"}
+    manifest.update(fields)
+    with open(manifest_path(job_id), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+def fetch_video(job_id):
+    """Download the video stream for an audio-only job on first request"""
+    if not re.fullmatch(r'[0-9a-f]+', job_id):
+        raise ValueError(f"Invalid job id: {job_id}")
+    if not os.path.exists(manifest_path(job_id)):
+        raise FileNotFoundError(f"No source recorded for job {job_id}")
+    with open(manifest_path(job_id)) as f:
+        manifest = json.load(f)
+    video_path = manifest['video_path']
+    
+    with video_fetch_locks_guard:
+        lock = video_fetch_locks.setdefault(job_id, threading.Lock())
+    
+    with lock:
+        if os.path.exists(video_path):
+            return video_path, False
+        
+        video = manifest.get('video_format') or video_format({})
+        cached, cache_key = download_cache_lookup(manifest['url'], video['label'])
+        if cached:
+            return cached['path'], False
+        
+        logging.info(f"[{job_id}] Fetching video stream on demand")
+        try:
+            download_video(manifest['url'], video_path, video['format'], job_id=job_id, format_sort=video['format_sort'])
+        except Exception:
+            if os.path.exists(video_path):
+                os.remove(video_path)
+            raise
+        download_cache_store(manifest['url'], video['label'], cache_key, video_path)
+    return video_path, True
+
+def model_registry_names():
+    names = list(WARM_MODELS)
+    names += [p['model'] for p in DECODING_PROFILES.values() if p['model'] not in names]
+    return names
+
+@app.errorhandler(PoolFull)
+def pool_full(e):
+    """Backpressure: tell the client when to come back instead of queueing forever"""
+    response = jsonify({'status': 'error', 'error': str(e), 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'ok',
-        'models_loaded': {
-            'base': True,
-            'tiny': True
+        'models_loaded': {name: model_registry.is_loaded(name) for name in model_registry_names()},
+        'transcript_cache': transcript_cache_summary(),
+        'batch_inference': batch_engine.summary(),
+        'download_engine': dict(ytdl_engine.summary(), engine=DOWNLOAD_ENGINE),
+        'execution_pool': execution_pool.summary(),
+        'transcribe_backend': {
+            'default': DEFAULT_BACKEND,
+            'available': [b for b in BACKENDS if backend_available(b)]
         }
     })
 
-@app.route('/transcribe', methods=['POST'])
-def transcribe_sync():
-    """Main endpoint - download and transcribe video"""
-    data = request.json
-    if not data or 'videoUrl' not in data:
-        return jsonify({'error': 'videoUrl is required'}), 400
+@app.route('/live', methods=['GET'])
+def live():
+    """Liveness - the process is up and serving requests"""
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness - every warm-up model is resident"""
+    resident = model_registry.status()
+    missing = [name for name in WARM_MODELS if name not in resident]
+    return jsonify({
+        'status': 'ready' if not missing else 'loading',
+        'models': resident,
+        'missing': missing,
+        'memory_budget_mb': MODEL_MEMORY_MB
+    }), 200 if not missing else 503
+
+@app.route('/models/warmup', methods=['POST'])
+def warmup_models():
+    """Load models in the background, e.g. before a batch that needs a larger model"""
+    names = (request.json or {}).get('models', WARM_MODELS)
+    unknown = [n for n in names if n not in whisper.available_models()]
+    if unknown:
+        return jsonify({'error': f"Unknown models: {', '.join(unknown)}"}), 400
+    threading.Thread(target=model_registry.warm_up, args=(names,), daemon=True).start()
+    return jsonify({'status': 'loading', 'models': names}), 202
+
+def transcribe_file(path, file_size, url, job_id, options, channel_id=None, on_segment=None):
+    """Transcribe a downloaded file: pick the profile, consult the transcript
+    cache, write the audio sidecar on a miss, resolve the language once and run
+    single-pass or parallel decoding. With on_segment, decoding runs window by
+    window and emits segments early.
     
-    url = data['videoUrl']
-    job_id = str(uuid.uuid4().hex)[:8]
-    temp_file = f"/data/{job_id}.mp4"
+    Returns (result, metadata) where metadata describes how it was produced
+    and carries the audio sidecar, if any, under 'audio_sidecar'.
+    """
+    use_cache = options.get('cache', True)
+    backend = options.get('backend') or DEFAULT_BACKEND
+    batched = options.get('batched', BATCH_INFERENCE) and backend == 'whisper'
+    requested_profile = options.get('profile') or 'auto'
+    hint = normalize_language(options.get('language'))
+    word_timestamps = options.get('word_timestamps', False)
+    
+    # Choose decoding profile, from the measured duration unless requested
+    duration = probe_duration(path)
+    profile = requested_profile if requested_profile != 'auto' else select_profile(duration)
+    model_name = DECODING_PROFILES[profile]['model']
+    logging.info(f"[{job_id}] Duration {duration:.0f}s, using profile '{profile}' ({model_name}, {backend})")
+    
+    metadata = {
+        'model_used': model_name,
+        'backend': backend,
+        'profile': profile,
+        'batched': batched,
+        'transcript_cache': 'bypass'
+    }
+    
+    # Never transcribe the same content with the same model and options twice
+    transcribe_start = time.time()
+    # Backends decode differently, so their transcripts are cached apart
+    model_label = model_name if backend == 'whisper' else f"{model_name}@{backend}"
+    if use_cache:
+        transcript_key = transcript_cache_key(file_digest(path), model_label, decode_options(profile, hint, word_timestamps))
+        entry = transcript_cache_get(transcript_key, file_size)
+        metadata['transcript_cache'] = 'hit' if entry else 'miss'
+        if entry:
+            logging.info(f"[{job_id}] Transcript cache hit, skipping transcription")
+            if on_segment:
+                for seg in entry['result']['segments']:
+                    on_segment(seg)
+            # Report a sidecar written by an earlier run, never decode for a hit
+            if options.get('audio_sidecar', True) and audio_sidecar_fresh(path):
+                metadata['audio_sidecar'] = ensure_audio_sidecar(path, job_id)
+            metadata['transcribe_time'] = time.time() - transcribe_start
+            return entry['result'], metadata
+    
+    # Decode once for Whisper here and for service2's audio scoring
+    if options.get('audio_sidecar', True):
+        metadata['audio_sidecar'] = ensure_audio_sidecar(path, job_id)
+    
+    # Only a cache miss needs the model, so hits never load or evict one
+    model = get_model(model_name, batched, backend)
+    
+    # Detect the language once (or take it from the hint / channel) for the whole file
+    if not hint and not channel_id:
+        channel_id = resolve_source_info(url)['channel_id']
+    language, language_info = resolve_language(path, model, duration, hint, channel_id, job_id)
+    options_used = decode_options(profile, language, word_timestamps)
+    
+    # Transcribe
+    logging.info(f"[{job_id}] Starting transcription...")
+    
+    # Long runs checkpoint their chunks under the key of the transcript they produce
+    checkpoint_key = None
+    if options.get('checkpoint', True) and duration >= CHECKPOINT_MIN_SECONDS:
+        checkpoint_key = transcript_cache_key(file_digest(path), model_label, options_used)
+    parallel = options.get('parallel', PARALLEL_DEFAULT) and duration >= PARALLEL_MIN_SECONDS
+    
+    if backend == 'whisper' and on_segment:
+        result = windowed_file_transcribe(path, model, job_id, on_segment, **options_used)
+        windows_spared = 1
+    elif backend == 'whisper' and parallel:
+        result, metadata['parallel'] = parallel_transcribe(path, model, model_name, job_id, checkpoint_key, **options_used)
+        metadata['batched'] = False  # chunks are decoded in the process pool
+        windows_spared = metadata['parallel']['chunks']
+    elif checkpoint_key:
+        result, metadata['checkpoint'] = checkpointed_transcribe(path, model, job_id, checkpoint_key, on_segment, **options_used)
+        windows_spared = metadata['checkpoint']['chunks']
+    elif backend != 'whisper':
+        # The backend streams its segments itself and keeps its own thread pool
+        result = model.transcribe(load_audio(path), on_segment=on_segment, **options_used)
+        windows_spared = 1
+    else:
+        result = model.transcribe(load_audio(path), verbose=False, **options_used)
+        windows_spared = 1
+    
+    # Without a fixed language every single-pass run or chunk would detect on its own
+    if language_info['source'] == 'detected':
+        windows_spared -= 1
+    language_info['time_saved'] = round(windows_spared * average_detect_time(), 2)
+    metadata['language_detection'] = language_info
     
+    if use_cache:
+        transcript_cache_put(transcript_key, result, time.time() - transcribe_start)
+    if checkpoint_key:
+        clear_checkpoint(checkpoint_key)
+    metadata['transcribe_time'] = time.time() - transcribe_start
+    return result, metadata
+
+def locate_source(url, job_id, options):
+    """Where a job's media goes and whether the download cache already has it"""
+    ingest = options.get('ingest', INGEST_DEFAULT)
+    video = video_format(options)
+    if ingest == 'audio':
+        # Transcription only needs audio; the video is fetched later if a clip step asks
+        path = f"/data/{job_id}.m4a"
+        fmt, format_sort, cache_kind = AUDIO_FORMAT, None, 'audio'
+    else:
+        path = f"/data/{job_id}.mp4"
+        fmt, format_sort, cache_kind = video['format'], video['format_sort'], video['label']
+    
+    # Reuse an earlier download of the same source (and rendition) if it is still on disk
+    use_cache = options.get('cache', True)
+    cached, cache_key = None, None
+    if use_cache:
+        cached, cache_key = download_cache_lookup(url, cache_kind)
+    source = {
+        'ingest': ingest,
+        'path': path,
+        'fmt': fmt,
+        'format_sort': format_sort,
+        'video_format': video,
+        'cache_kind': cache_kind,
+        'use_cache': use_cache,
+        'cached': cached,
+        'cache_key': cache_key,
+        'cache_status': ('hit' if cached else 'miss') if use_cache else 'bypass',
+        'download_stats': {},
+        'ready': False
+    }
+    if cached:
+        logging.info(f"[{job_id}] Download cache hit: {cached['path']}")
+        source.update(path=cached['path'], size=cached['size'], download_time=0.0, ready=True)
+    return source
+
+def download_source(url, job_id, options, source=None):
+    """Download stage of transcribe_video(), separate so batches can prefetch"""
+    source = source or locate_source(url, job_id, options)
+    if source['ready']:
+        return source
+    
+    logging.info(f"[{job_id}] Starting download from: {url}")
+    start_time = time.time()
     try:
-        # Download video
-        logging.info(f"[{job_id}] Starting download from: {url}")
-        start_time = time.time()
+        file_size = download_video(url, source['path'], source['fmt'], job_id, options.get('engine'),
+                                   options.get('downloader'), source['download_stats'], source['format_sort'])
+        if source['use_cache']:
+            download_cache_store(url, source['cache_kind'], source['cache_key'], source['path'])
+    except Exception:
+        if os.path.exists(source['path']):
+            os.remove(source['path'])
+        raise
+    
+    if source['ingest'] != 'audio':
+        source['download_stats']['format_target'] = source['video_format']['target']
+    source.update(size=file_size, download_time=time.time() - start_time, ready=True)
+    logging.info(f"[{job_id}] Downloaded in {source['download_time']:.1f}s: {file_size/1024/1024:.1f} MB")
+    return source
+
+def transcribe_video(url, job_id, options=None, on_segment=None, source=None):
+    """Download and transcribe a video, returning the response payload.
+    
+    on_segment, if given, is called with every segment as soon as it is final.
+    source, if given, is an already downloaded source from download_source().
+    """
+    options = options or {}
+    source = source or locate_source(url, job_id, options)
+    ingest = source['ingest']
+    temp_file = source['path']
+    cached = source['cached']
+    
+    try:
+        streaming = options.get('streaming', STREAMING_DEFAULT) and (options.get('backend') or DEFAULT_BACKEND) == 'whisper'
+        if streaming and not source['ready']:
+            # Download and transcribe at the same time; duration is unknown up front
+            logging.info(f"[{job_id}] Starting streaming transcription from: {url}")
+            start_time = time.time()
+            requested_profile = options.get('profile') or 'auto'
+            profile = requested_profile if requested_profile != 'auto' else DEFAULT_PROFILE
+            model_name = DECODING_PROFILES[profile]['model']
+            batched = options.get('batched', BATCH_INFERENCE)
+            
+            # No audio yet to detect from: use the hint or the channel's known language
+            language = normalize_language(options.get('language'))
+            lang_source = 'hint' if language else 'streamed'
+            if not language:
+                known = channel_language(resolve_source_info(url)['channel_id'])
+                if known:
+                    language, lang_source = known['language'], 'channel'
+            
+            with execution_pool.slot(job_id):
+                result, stream_stats = stream_transcribe(
+                    url, temp_file, get_model(model_name, batched), job_id,
+                    fmt=source['fmt'],
+                    format_sort=source['format_sort'],
+                    on_segment=on_segment,
+                    verbose=None,
+                    **decode_options(profile, language, options.get('word_timestamps', False))
+                )
+            file_size = check_downloaded_file(temp_file)
+            if source['use_cache']:
+                download_cache_store(url, source['cache_kind'], source['cache_key'], temp_file)
+            audio_sidecar = ensure_audio_sidecar(temp_file, job_id) if options.get('audio_sidecar', True) else None
+            total_time = time.time() - start_time
+            download_time = transcribe_time = total_time
+            transcription_info = {
+                'model_used': model_name,
+                'backend': 'whisper',
+                'profile': profile,
+                'batched': batched,
+                'transcript_cache': 'bypass',
+                'streaming': stream_stats,
+                'language_detection': {'language': result.get('language'), 'source': lang_source}
+            }
+            logging.info(f'[{job_id}] Streaming transcription completed in {total_time:.1f}s')
+        else:
+            download_source(url, job_id, options, source)
+            file_size = source['size']
+            download_time = source['download_time']
+            
+            channel_id = cached.get('channel_id') if cached else None
+            with execution_pool.slot(job_id):
+                result, transcription_info = transcribe_file(temp_file, file_size, url, job_id, options, channel_id, on_segment)
+            transcribe_time = transcription_info.pop('transcribe_time')
+            audio_sidecar = transcription_info.pop('audio_sidecar', None)
+            total_time = download_time + transcribe_time
+            logging.info(f'[{job_id}] Transcription completed in {transcribe_time:.1f}s')
         
-        file_size = download_video(url, temp_file)
+        # НЕ УДАЛЯЕМ ФАЙЛ - он нужен для service2
         
-        download_time = time.time() - start_time
-        logging.info(f"[{job_id}] Downloaded in {download_time:.1f}s: {file_size/1024/1024:.1f} MB")
+        if ingest == 'audio':
+            # The video fetched later for this job uses the same rendition choice
+            write_manifest(job_id, url, ingest=ingest, audio_sidecar=audio_sidecar, video_format=source['video_format'])
+        else:
+            write_manifest(job_id, url, ingest=ingest, video_path=temp_file, audio_sidecar=audio_sidecar)
+        
+        metadata = {
+            'ingest': ingest,
+            'download_cache': source['cache_status'],
+            'download_time': round(download_time, 1),
+            'transcribe_time': round(transcribe_time, 1),
+            'total_time': round(total_time, 1),
+            'file_size_mb': round(file_size/1024/1024, 1)
+        }
+        if source['download_stats']:
+            metadata['download_stats'] = source['download_stats']
+        metadata.update(transcription_info)
         
-        # Choose model based on file size
-        if file_size > 100 * 1024 * 1024:  # > 100MB
-            logging.info(f"[{job_id}] Large file detected, using tiny model for speed")
-            model = model_tiny
+        words = None
+        if options.get('word_timestamps'):
+            words = write_word_sidecar(result, job_id)
+        transcript_ref = save_transcript(job_id, result, words['path'] if words else None)
+        try:
+            index_transcript(job_id, url, result)
+        except sqlite3.Error as e:
+            logging.warning(f"[{job_id}] Could not index transcript for search: {e}")
+        transcript_format = options.get('transcript_format', TRANSCRIPT_FORMAT_DEFAULT)
+        if transcript_format == 'slim':
+            transcript = {'text': result['text'], 'language': result.get('language'), 'segments': slim_segments(result)}
+        elif transcript_format == 'none':
+            transcript = None
         else:
-            model = model_base
-        
-        # Transcribe
-        logging.info(f"[{job_id}] Starting transcription...")
-        transcribe_start = time.time()
-        
-        # Use language detection for better results
-        result = model.transcribe(
-            temp_file, 
-            fp16=False,
-            language=None,  # Auto-detect language
-            task='transcribe',
-            verbose=False
-        )
-        transcribe_time = time.time() - transcribe_start
-        logging.info(f'[{job_id}] Transcription completed in {transcribe_time:.1f}s')
-        
-        # Cleanup
-        if os.path.exists(temp_file):
-            # НЕ УДАЛЯЕМ ФАЙЛ - он нужен для service2
-            # os.remove(temp_file) - закомментируйте эту строку если она есть
-            pass
+            transcript = result
         
-        return jsonify({
+        response = {
             'status': 'success',
-            'transcript': result,
+            'job_id': job_id,
+            'transcript': transcript,
+            'transcript_ref': transcript_ref,
+            'word_timestamps': words,
             'text': result['text'],
             'language': result.get('language', 'unknown'),
             'video_path': temp_file,  # ДОБАВЛЕНО: путь к видео
-            'metadata': {
-                'download_time': round(download_time, 1),
-                'transcribe_time': round(transcribe_time, 1),
-                'total_time': round(download_time + transcribe_time, 1),
-                'file_size_mb': round(file_size/1024/1024, 1),
-                'model_used': 'tiny' if file_size > 100 * 1024 + 1024 else 'base'
-            }
-        }), 200
+            'audio_sidecar': audio_sidecar,
+            'metadata': metadata
+        }
+        if ingest == 'audio':
+            # video_path stays None until POST /video (or service2) fetches it
+            response['audio_path'] = temp_file
+            response['video_path'] = None
+        return response
+    except Exception:
+        # Cleanup on error (cached files belong to the cache)
+        if not cached and os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def flight_key(url, options):
+    """Same normalized URL and same result-affecting options -> same flight"""
+    relevant = {k: v for k, v in (options or {}).items() if k not in FLIGHT_IGNORED_OPTIONS}
+    digest = hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()[:12]
+    return f"{normalize_url(url)}#{digest}"
+
+def as_follower(result, leader_job_id):
+    result = dict(result)
+    result['metadata'] = dict(result.get('metadata', {}), deduplicated_from=leader_job_id)
+    return result
+
+def redis_single_flight(key, job_id, fn):
+    """Cross-replica single-flight: the replica holding the Redis lease runs fn,
+    the others poll for its published result (or take over if the lease expires)"""
+    lock_key = f"{FLIGHT_KEY_PREFIX}{key}"
+    result_key = f"{lock_key}:result"
+    
+    while True:
+        try:
+            acquired = redis_client.set(lock_key, job_id, nx=True, ex=FLIGHT_LEASE_SECONDS)
+            leader = None if acquired else redis_client.get(lock_key)
+        except redis.RedisError as e:
+            logging.warning(f"[{job_id}] Single-flight coordination unavailable: {e}")
+            return fn()
+        
+        if acquired:
+            stop = threading.Event()
+            
+            def renew():
+                while not stop.wait(FLIGHT_LEASE_SECONDS / 3):
+                    try:
+                        redis_client.expire(lock_key, FLIGHT_LEASE_SECONDS)
+                    except redis.RedisError:
+                        pass
+            
+            threading.Thread(target=renew, daemon=True).start()
+            payload = {'leader': job_id}
+            try:
+                payload['result'] = fn()
+                return payload['result']
+            except Exception as e:
+                payload['error'] = str(e)
+                raise
+            finally:
+                stop.set()
+                try:
+                    redis_client.set(result_key, json.dumps(payload), ex=FLIGHT_RESULT_TTL)
+                    redis_client.delete(lock_key)
+                except redis.RedisError as e:
+                    logging.warning(f"[{job_id}] Could not publish single-flight result: {e}")
+        
+        if leader is None:
+            continue  # lease expired between SET and GET, try to take it
+        
+        logging.info(f"[{job_id}] Identical request in flight as {leader}, waiting for its result")
+        while True:
+            time.sleep(1)
+            # Lease before result: the leader publishes its result before it
+            # drops the lease, so a lease seen gone means the result is visible
+            try:
+                current = redis_client.get(lock_key)
+                payload = redis_client.get(result_key)
+            except redis.RedisError:
+                continue
+            if payload:
+                payload = json.loads(payload)
+                if payload['leader'] == leader:
+                    if 'error' in payload:
+                        raise RuntimeError(payload['error'])
+                    return as_follower(payload['result'], leader)
+            if current != leader:
+                break  # leader finished without a result we can see, or died
+
+def single_flight_transcribe(url, job_id, options=None):
+    """transcribe_video() with in-flight deduplication across threads and replicas"""
+    key = flight_key(url, options)
+    with inflight_lock:
+        call = inflight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = {'event': threading.Event(), 'leader': job_id}
+            inflight[key] = call
+    
+    if not is_leader:
+        logging.info(f"[{job_id}] Attaching to in-flight job {call['leader']}")
+        call['event'].wait()
+        if 'error' in call:
+            raise RuntimeError(call['error'])
+        return as_follower(call['result'], call['leader'])
+    
+    try:
+        call['result'] = redis_single_flight(key, job_id, lambda: transcribe_video(url, job_id, options))
+        return call['result']
+    except Exception as e:
+        call['error'] = str(e)
+        raise
+    finally:
+        with inflight_lock:
+            inflight.pop(key, None)
+        call['event'].set()
+
+def validate_options(options):
+    """Return an error message for invalid transcription options, None if fine"""
+    profile = options.get('profile')
+    if profile and profile != 'auto' and profile not in DECODING_PROFILES:
+        return f"Unknown profile '{profile}', expected one of: auto, {', '.join(DECODING_PROFILES)}"
+    backend = options.get('backend')
+    if backend and backend not in BACKENDS:
+        return f"Unknown backend '{backend}', expected one of: {', '.join(BACKENDS)}"
+    if backend and not backend_available(backend):
+        return f"Backend '{backend}' is not installed on this server"
+    engine = options.get('engine')
+    if engine and engine not in DOWNLOAD_ENGINES:
+        return f"Unknown engine '{engine}', expected one of: {', '.join(DOWNLOAD_ENGINES)}"
+    ingest = options.get('ingest')
+    if ingest and ingest not in INGESTS:
+        return f"Unknown ingest '{ingest}', expected one of: {', '.join(INGESTS)}"
+    downloader = options.get('downloader')
+    if downloader and downloader not in DOWNLOADERS:
+        return f"Unknown downloader '{downloader}', expected one of: {', '.join(DOWNLOADERS)}"
+    format_target = options.get('format_target')
+    if format_target and format_target not in FORMAT_TARGETS:
+        return f"Unknown format_target '{format_target}', expected one of: {', '.join(FORMAT_TARGETS)}"
+    for key in ('max_resolution', 'max_fps'):
+        value = options.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value <= 0):
+            return f"{key} must be a positive integer"
+    prefetch = options.get('prefetch')
+    if prefetch is not None and (not isinstance(prefetch, int) or isinstance(prefetch, bool)
+                                 or not 0 <= prefetch <= BATCH_MAX_PREFETCH):
+        return f"prefetch must be an integer from 0 to {BATCH_MAX_PREFETCH}"
+    transcript_format = options.get('transcript_format')
+    if transcript_format and transcript_format not in TRANSCRIPT_FORMATS:
+        return f"Unknown transcript_format '{transcript_format}', expected one of: {', '.join(TRANSCRIPT_FORMATS)}"
+    try:
+        normalize_language(options.get('language'))
+    except ValueError as e:
+        return str(e)
+    return None
+
+@app.route('/transcribe', methods=['POST'])
+def transcribe_sync():
+    """Main endpoint - download and transcribe video"""
+    data = request.json
+    if not data or 'videoUrl' not in data:
+        return jsonify({'error': 'videoUrl is required'}), 400
+    error = validate_options(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    url = data['videoUrl']
+    job_id = str(uuid.uuid4().hex)[:8]
+    
+    try:
+        with execution_pool.admit():
+            return jsonify(single_flight_transcribe(url, job_id, data)), 200
+    except PoolFull:
+        raise
     except Exception as e:
         logging.error(f"[{job_id}] Error: {str(e)}")
         import traceback
         logging.error(traceback.format_exc())
         
-        # Cleanup on error
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-        
         return jsonify({
             'status': 'error',
             'error': str(e)
         }), 500
 
+@app.route('/transcribe/stream', methods=['POST'])
+def transcribe_stream():
+    """Like /transcribe, but sends each segment as soon as Whisper finishes it,
+    as NDJSON (default) or Server-Sent Events (`"format": "sse"` or
+    `Accept: text/event-stream`), followed by a final summary record"""
+    data = request.json
+    if not data or 'videoUrl' not in data:
+        return jsonify({'error': 'videoUrl is required'}), 400
+    error = validate_options(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    url = data['videoUrl']
+    job_id = str(uuid.uuid4().hex)[:8]
+    sse = data.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    # The summary carries the handle, so the transcript itself is not repeated
+    options = dict(data, transcript_format='none')
+    records = queue.Queue()
+    
+    def on_segment(seg):
+        records.put(('segment', {
+            'id': seg['id'],
+            'start': round(seg['start'], 3),
+            'end': round(seg['end'], 3),
+            'text': seg['text']
+        }))
+    
+    def run():
+        try:
+            records.put(('summary', transcribe_video(url, job_id, options, on_segment)))
+        except Exception as e:
+            logging.error(f"[{job_id}] Error: {str(e)}")
+            records.put(('error', {'status': 'error', 'job_id': job_id, 'error': str(e)}))
+    
+    def generate():
+        threading.Thread(target=run, daemon=True).start()
+        while True:
+            kind, payload = records.get()
+            if sse:
+                yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            else:
+                yield json.dumps(dict(payload, type=kind), ensure_ascii=False) + '\n'
+            if kind != 'segment':
+                break
+    
+    execution_pool.try_admit()
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype, headers={'X-Job-Id': job_id, 'Cache-Control': 'no-cache'})
+    response.call_on_close(execution_pool.release)
+    return response
+
+@app.route('/transcribe/batch', methods=['POST'])
+def transcribe_batch():
+    """Transcribe a list of videos in one request, streaming an NDJSON record
+    per item in input order, followed by a summary record.
+    
+    Downloads run up to BATCH_PREFETCH items ahead of the one being
+    transcribed, so the network and Whisper stay busy at the same time.
+    """
+    data = request.json or {}
+    items, error = parse_batch_items(data)
+    if error:
+        return jsonify({'error': error}), 400
+    prefetch = data.get('prefetch', BATCH_PREFETCH)
+    batch_id = str(uuid.uuid4().hex)[:8]
+    
+    # Pipelining needs the download finished before transcription starts
+    jobs = [(url, record_id, dict(options, streaming=False), str(uuid.uuid4().hex)[:8])
+            for url, record_id, options in items]
+    
+    def generate():
+        start_time = time.time()
+        pool = ThreadPoolExecutor(max_workers=max(prefetch, 1), thread_name_prefix=f'batch-{batch_id}')
+        downloads = {}
+        failed = 0
+        try:
+            for index, (url, record_id, options, job_id) in enumerate(jobs):
+                # Keep the current item and the next `prefetch` ones downloading
+                for ahead in range(index, min(index + prefetch + 1, len(jobs))):
+                    if ahead not in downloads:
+                        a_url, _, a_options, a_job_id = jobs[ahead]
+                        downloads[ahead] = pool.submit(download_source, a_url, a_job_id, a_options)
+                
+                record = {'type': 'result', 'index': index, 'videoUrl': url, 'recordId': record_id}
+                try:
+                    source = downloads.pop(index).result()
+                    record.update(transcribe_video(url, job_id, options, source=source))
+                except Exception as e:
+                    logging.error(f"[{job_id}] Batch {batch_id} item {index} failed: {str(e)}")
+                    record.update(type='error', status='error', job_id=job_id, error=str(e))
+                    failed += 1
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+            
+            yield json.dumps({
+                'type': 'summary',
+                'batch_id': batch_id,
+                'total': len(jobs),
+                'succeeded': len(jobs) - failed,
+                'failed': failed,
+                'total_time': round(time.time() - start_time, 1)
+            }) + '\n'
+        finally:
+            # Client went away: drop downloads that have not started yet
+            for future in downloads.values():
+                future.cancel()
+            pool.shutdown(wait=False)
+    
+    execution_pool.try_admit()
+    logging.info(f"Batch {batch_id}: {len(jobs)} items, prefetch {prefetch}")
+    response = Response(generate(), mimetype='application/x-ndjson',
+                        headers={'X-Batch-Id': batch_id, 'Cache-Control': 'no-cache'})
+    response.call_on_close(execution_pool.release)
+    return response
+
+def job_key(job_id):
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+def enqueue_job(url, record_id=None, options=None):
+    """Create a job record in Redis and push it onto the work queue"""
+    job_id = str(uuid.uuid4().hex)[:8]
+    key = job_key(job_id)
+    redis_client.hset(key, mapping={
+        'job_id': job_id,
+        'state': 'queued',
+        'videoUrl': url,
+        'recordId': record_id or '',
+        'options': json.dumps(options or {}),
+        'queued_at': time.time()
+    })
+    redis_client.expire(key, JOB_TTL)
+    redis_client.rpush(JOB_QUEUE_KEY, job_id)
+    logging.info(f"[{job_id}] Queued: {url}")
+    return job_id
+
+def run_job(job_id):
+    """Execute a queued job and store its outcome"""
+    key = job_key(job_id)
+    url, options = redis_client.hmget(key, 'videoUrl', 'options')
+    if not url:
+        logging.warning(f"[{job_id}] Job record missing, skipping")
+        return
+    options = json.loads(options) if options else {}
+    
+    redis_client.hset(key, mapping={'state': 'running', 'started_at': time.time()})
+    try:
+        result = single_flight_transcribe(url, job_id, options)
+        redis_client.hset(key, mapping={
+            'state': 'done',
+            'finished_at': time.time(),
+            'result': json.dumps(result)
+        })
+    except Exception as e:
+        logging.error(f"[{job_id}] Error: {str(e)}")
+        import traceback
+        logging.error(traceback.format_exc())
+        redis_client.hset(key, mapping={
+            'state': 'failed',
+            'finished_at': time.time(),
+            'error': str(e)
+        })
+    redis_client.expire(key, JOB_TTL)
+
+def processing_key(worker_id):
+    return f"{JOB_PROCESSING_PREFIX}{WORKER_NAME}:{worker_id}"
+
+def requeue_unfinished(worker_id):
+    """Put jobs a previous run of this worker took but never finished back
+    at the head of the queue"""
+    processing = processing_key(worker_id)
+    while True:
+        job_id = redis_client.lmove(processing, JOB_QUEUE_KEY, 'RIGHT', 'LEFT')
+        if job_id is None:
+            return
+        redis_client.hset(job_key(job_id), 'state', 'queued')
+        logging.warning(f"[{job_id}] Requeued after worker {worker_id} stopped while running it")
+
+def job_worker(worker_id):
+    """Worker loop - pull job ids from the Redis queue and run them"""
+    logging.info(f"Transcription worker {worker_id} started")
+    processing = processing_key(worker_id)
+    recovered = False
+    while True:
+        try:
+            if not recovered:
+                requeue_unfinished(worker_id)
+                recovered = True
+            # The id stays on the processing list until the job finished, so a
+            # crash mid-job does not lose it
+            job_id = redis_client.blmove(JOB_QUEUE_KEY, processing, 5, 'LEFT', 'RIGHT')
+        except redis.RedisError as e:
+            logging.error(f"Worker {worker_id}: Redis error: {e}")
+            time.sleep(5)
+            continue
+        
+        if not job_id:
+            continue
+        try:
+            run_job(job_id)
+        except redis.RedisError as e:
+            # The outcome could not be stored: leave the id on the processing
+            # list and requeue it once Redis answers again
+            logging.error(f"[{job_id}] Redis error while running job, will retry: {e}")
+            recovered = False
+            time.sleep(5)
+            continue
+        except Exception as e:
+            logging.error(f"[{job_id}] Worker {worker_id} could not run job: {e}")
+        try:
+            redis_client.lrem(processing, 1, job_id)
+        except redis.RedisError as e:
+            logging.error(f"[{job_id}] Cannot clear processing entry: {e}")
+
+def start_workers():
+    for i in range(TRANSCRIBE_WORKERS):
+        threading.Thread(target=job_worker, args=(i,), daemon=True).start()
+
+def parse_batch_items(data):
+    """Turn a request body into [(url, record_id, options)], or return an error.
+    
+    Accepts a single videoUrl or a batch of videoUrls (strings or
+    {videoUrl, recordId, ...}). Remaining top-level fields are transcription
+    options shared by every item; per-item fields override them.
+    """
+    items = data.get('videoUrls')
+    if items is None and 'videoUrl' in data:
+        items = [{'videoUrl': data['videoUrl'], 'recordId': data.get('recordId')}]
+    if not items:
+        return None, 'videoUrl or videoUrls is required'
+    
+    base_options = {k: v for k, v in data.items() if k not in ('videoUrl', 'videoUrls', 'recordId')}
+    
+    parsed = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'videoUrl': item}
+        if not item.get('videoUrl'):
+            return None, 'every item needs a videoUrl'
+        options = dict(base_options)
+        options.update({k: v for k, v in item.items() if k not in ('videoUrl', 'recordId')})
+        error = validate_options(options)
+        if error:
+            return None, error
+        parsed.append((item['videoUrl'], item.get('recordId'), options))
+    return parsed, None
+
+@app.route('/jobs', methods=['POST'])
+def submit_jobs():
+    """Queue one or more videos for transcription, return job ids immediately"""
+    items, error = parse_batch_items(request.json or {})
+    if error:
+        return jsonify({'error': error}), 400
+    
+    jobs = []
+    try:
+        for url, record_id, options in items:
+            job_id = enqueue_job(url, record_id, options)
+            jobs.append({
+                'job_id': job_id,
+                'videoUrl': url,
+                'recordId': record_id
+            })
+        queue_depth = redis_client.llen(JOB_QUEUE_KEY)
+    except redis.RedisError as e:
+        logging.error(f"Cannot queue jobs: {e}")
+        return jsonify({'status': 'error', 'error': f'Job queue unavailable: {e}'}), 503
+    
+    response = {'status': 'queued', 'jobs': jobs, 'queue_depth': queue_depth}
+    if len(jobs) == 1:
+        response['job_id'] = jobs[0]['job_id']
+    return jsonify(response), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll job state, timings and result"""
+    try:
+        job = redis_client.hgetall(job_key(job_id))
+    except redis.RedisError as e:
+        return jsonify({'status': 'error', 'error': f'Job queue unavailable: {e}'}), 503
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    
+    queued_at = float(job['queued_at'])
+    started_at = float(job['started_at']) if job.get('started_at') else None
+    finished_at = float(job['finished_at']) if job.get('finished_at') else None
+    
+    timings = {
+        'queued_at': queued_at,
+        'started_at': started_at,
+        'finished_at': finished_at,
+        'queue_wait': round((started_at or time.time()) - queued_at, 1),
+        'run_time': round((finished_at or time.time()) - started_at, 1) if started_at else None
+    }
+    
+    # Live download progress published by the in-process engine
+    progress = None
+    if job['state'] == 'running':
+        try:
+            progress = redis_client.get(f"{PROGRESS_KEY_PREFIX}{job_id}")
+        except redis.RedisError:
+            pass
+    
+    return jsonify({
+        'job_id': job_id,
+        'state': job['state'],
+        'videoUrl': job.get('videoUrl'),
+        'recordId': job.get('recordId') or None,
+        'timings': timings,
+        'download_progress': json.loads(progress) if progress else None,
+        'result': json.loads(job['result']) if job.get('result') else None,
+        'error': job.get('error')
+    }), 200
+
+@app.route('/search', methods=['GET'])
+def search():
+    """Find transcript segments by text across every video transcribed so far"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), SEARCH_MAX_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    video = request.args.get('video')
+    phrase = request.args.get('phrase') in ('1', 'true')
+    
+    results = search_transcripts(query, limit, normalize_url(video) if video else None, phrase)
+    return jsonify({'query': query, 'results': results, 'total': len(results)})
+
+@app.route('/search/reindex', methods=['POST'])
+def reindex_search():
+    """Index transcripts saved before the search index existed"""
+    indexed, skipped = 0, 0
+    for name in sorted(os.listdir(TRANSCRIPTS_DIR)):
+        if not name.endswith('.json.gz'):
+            continue
+        transcript_id = name[:-len('.json.gz')]
+        try:
+            with open(manifest_path(transcript_id)) as f:
+                url = json.load(f)['url']
+            with gzip.open(transcript_path(transcript_id), 'rt', encoding='utf-8') as f:
+                compact = json.load(f)
+        except (OSError, ValueError, KeyError):
+            skipped += 1
+            continue
+        index_transcript(transcript_id, url, {
+            'language': compact.get('language'),
+            'segments': [{'start': st, 'end': en, 'text': text}
+                         for st, en, text in zip(compact['start'], compact['end'], compact['segments'])]
+        })
+        indexed += 1
+    return jsonify({'indexed': indexed, 'skipped': skipped})
+
+@app.route('/video', methods=['POST'])
+def get_video():
+    """Return video_path for a job, downloading the video if only audio was ingested"""
+    data = request.json or {}
+    job_id = data.get('job_id')
+    if not job_id:
+        return jsonify({'error': 'job_id is required'}), 400
+    
+    start_time = time.time()
+    try:
+        video_path, downloaded = fetch_video(job_id)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 404
+    except Exception as e:
+        logging.error(f"[{job_id}] Video fetch error: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+    
+    return jsonify({
+        'status': 'success',
+        'job_id': job_id,
+        'video_path': video_path,
+        'downloaded': downloaded,
+        'download_time': round(time.time() - start_time, 1)
+    }), 200
+
 # Legacy endpoints for compatibility
 @app.route('/download-transcribe', methods=['POST'])
 def download_transcribe():
@@ -167,5 +2837,10 @@ def process():
     """Another legacy endpoint"""
     return transcribe_sync()
 
-if __name__ == '__main__':
+def main():
+    threading.Thread(target=model_registry.warm_up, args=(WARM_MODELS,), daemon=True).start()
+    start_workers()
     app.run(host='0.0.0.0', port=3001, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""decode_windows() must decode one window at a time even when all audio is buffered"""
+import os
+import sys
+
+import pytest
+
+for module in ('numpy', 'flask', 'redis', 'torch', 'whisper', 'yt_dlp'):
+    pytest.importorskip(module)
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import service1  # noqa: E402
+
+SAMPLE_RATE = service1.SAMPLE_RATE
+WINDOW = service1.STREAM_WINDOW_SECONDS * SAMPLE_RATE
+
+
+class HalvesModel:
+    """Fake model: every window becomes two segments, one per half"""
+
+    def __init__(self):
+        self.calls = []
+        self.prompts = []
+
+    def transcribe(self, audio, **options):
+        self.calls.append(len(audio))
+        self.prompts.append(options.get('initial_prompt'))
+        seconds = len(audio) / SAMPLE_RATE
+        return {
+            'language': 'en',
+            'segments': [
+                {'start': 0.0, 'end': seconds / 2, 'text': ' a'},
+                {'start': seconds / 2, 'end': seconds, 'text': ' b'}
+            ]
+        }
+
+
+def test_fully_buffered_hour_is_decoded_window_by_window():
+    duration = 3600
+    pcm = service1.PCMStream()
+    pcm.append(np.zeros(duration * SAMPLE_RATE, np.int16).tobytes())
+    pcm.close()
+
+    model = HalvesModel()
+    emitted = []
+    segments, language, _ = service1.decode_windows(pcm, model, 'test', on_segment=emitted.append)
+
+    # Every call sees at most one window; the provisional tail (second half)
+    # is decoded again at the start of the next window
+    assert max(model.calls) == WINDOW
+    step = service1.STREAM_WINDOW_SECONDS / 2
+    assert len(model.calls) == duration / step - 1
+
+    # All but the last window commit their first half, the last one both halves
+    assert [seg['start'] for seg in segments] == [i * step for i in range(len(segments))]
+    assert [seg['id'] for seg in segments] == list(range(len(segments)))
+    assert segments[-1]['end'] == duration
+    assert emitted == segments
+    assert language == 'en'
+
+
+def test_short_buffered_input_is_one_call():
+    pcm = service1.PCMStream()
+    pcm.append(np.zeros(10 * SAMPLE_RATE, np.int16).tobytes())
+    pcm.close()
+
+    model = HalvesModel()
+    segments, _, _ = service1.decode_windows(pcm, model, 'test')
+
+    assert model.calls == [10 * SAMPLE_RATE]
+    assert [(seg['start'], seg['end']) for seg in segments] == [(0.0, 5.0), (5.0, 10.0)]
+
+
+def test_prompt_follows_condition_on_previous_text():
+    for condition, prompted in ((True, True), (False, False)):
+        pcm = service1.PCMStream()
+        pcm.append(np.zeros(120 * SAMPLE_RATE, np.int16).tobytes())
+        pcm.close()
+
+        model = HalvesModel()
+        service1.decode_windows(pcm, model, 'test', condition_on_previous_text=condition)
+
+        assert model.prompts[0] is None
+        assert all((prompt is not None) == prompted for prompt in model.prompts[1:])
+
+
+class SilenceModel(HalvesModel):
+    """Fake model that only finds zero-length segments at the window start"""
+
+    def transcribe(self, audio, **options):
+        self.calls.append(len(audio))
+        return {
+            'language': 'en',
+            'segments': [
+                {'start': 0.0, 'end': 0.0, 'text': ''},
+                {'start': 0.0, 'end': 0.0, 'text': ''}
+            ]
+        }
+
+
+def test_tail_near_window_start_commits_the_whole_window():
+    duration = 300
+    pcm = service1.PCMStream()
+    pcm.append(np.zeros(duration * SAMPLE_RATE, np.int16).tobytes())
+    pcm.close()
+
+    model = SilenceModel()
+    service1.decode_windows(pcm, model, 'test')
+
+    assert model.calls == [WINDOW] * (duration // service1.STREAM_WINDOW_SECONDS)
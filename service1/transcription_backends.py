@@ -0,0 +1,90 @@
+"""Transcription backends for service1.
+
+'whisper' runs openai-whisper in fp32 on torch. 'ctranslate2' runs the same
+checkpoints converted to CTranslate2 through faster-whisper, int8-quantized by
+default, which is several times faster on CPU and needs a fraction of the
+memory. Both return whisper's result dict (text, segments, language), so the
+rest of the service does not care which one produced a transcript.
+"""
+import os
+import whisper
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:  # optional, only needed for the ctranslate2 backend
+    WhisperModel = None
+
+BACKENDS = ('whisper', 'ctranslate2')
+DEFAULT_BACKEND = os.environ.get('TRANSCRIBE_BACKEND', 'whisper')
+CT2_COMPUTE_TYPE = os.environ.get('CT2_COMPUTE_TYPE', 'int8')
+
+# Bytes per parameter, for the model registry's memory budget
+BYTES_PER_PARAM = {'whisper': 4, 'ctranslate2': 1 if CT2_COMPUTE_TYPE.startswith('int8') else 2}
+
+def backend_available(backend):
+    return backend == 'whisper' or (backend == 'ctranslate2' and WhisperModel is not None)
+
+def ct2_options(options):
+    """Translate whisper transcribe() keyword arguments to faster-whisper ones"""
+    kwargs = {k: v for k, v in options.items() if k not in ('fp16', 'verbose')}
+    # whisper treats None as greedy / a single sample, faster-whisper defaults to 5
+    kwargs['beam_size'] = kwargs.get('beam_size') or 1
+    kwargs['best_of'] = kwargs.get('best_of') or 1
+    if isinstance(kwargs.get('temperature'), tuple):
+        kwargs['temperature'] = list(kwargs['temperature'])
+    return kwargs
+
+class CT2Model:
+    """faster-whisper model behind whisper's transcribe() interface"""
+
+    backend = 'ctranslate2'
+
+    def __init__(self, name, compute_type=CT2_COMPUTE_TYPE, cpu_threads=0):
+        if WhisperModel is None:
+            raise RuntimeError("The ctranslate2 backend needs the faster-whisper package")
+        self.name = name
+        self.compute_type = compute_type
+        self.model = WhisperModel(name, device='cpu', compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, audio, verbose=None, on_segment=None, **options):
+        """audio is a path or 16 kHz mono float32 samples, as for whisper"""
+        segments, info = self.model.transcribe(audio, **ct2_options(options))
+        result = []
+        # Segments are decoded lazily while the generator is consumed
+        for seg in segments:
+            item = {
+                'id': seg.id - 1,  # faster-whisper counts from 1
+                'seek': seg.seek,
+                'start': seg.start,
+                'end': seg.end,
+                'text': seg.text,
+                'tokens': list(seg.tokens),
+                'temperature': seg.temperature,
+                'avg_logprob': seg.avg_logprob,
+                'compression_ratio': seg.compression_ratio,
+                'no_speech_prob': seg.no_speech_prob
+            }
+            if seg.words is not None:
+                item['words'] = [
+                    {'word': w.word, 'start': w.start, 'end': w.end, 'probability': w.probability}
+                    for w in seg.words
+                ]
+            result.append(item)
+            if on_segment:
+                on_segment(item)
+        return {
+            'text': ''.join(seg['text'] for seg in result),
+            'segments': result,
+            'language': info.language
+        }
+
+    def detect_language(self, audio):
+        """(language, probability) for 16 kHz float32 samples"""
+        # Detection runs eagerly inside transcribe(); the segments are never decoded
+        _, info = self.model.transcribe(audio, beam_size=1)
+        return info.language, float(info.language_probability)
+
+def load_model(name, backend='whisper', cpu_threads=0):
+    if backend == 'ctranslate2':
+        return CT2Model(name, cpu_threads=cpu_threads)
+    return whisper.load_model(name)
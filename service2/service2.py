@@ -7,11 +7,101 @@ import json
 import shutil
 from datetime import datetime
 import numpy as np
-import cv2
+import urllib.request
+import gzip
+import re
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
+SERVICE1_URL = os.environ.get('SERVICE1_URL', 'http://service1:3001')
+
+TRANSCRIPTS_DIR = '/data/transcripts'
+
+# Огибающая громкости от service1: уровень в dBFS на каждые 100 мс
+LOUDNESS_WINDOW_SECONDS = 0.1
+
+# Таймлайн движения: кадры в оттенках серого 160x90, 5 кадров в секунду
+MOTION_FPS = 5
+MOTION_FRAME_SIZE = (160, 90)
+MOTION_WINDOW_SECONDS = 5  # визуальный скор считаем по первым 5 с сегмента
+
+def load_transcript_ref(ref):
+    """Загрузить транскрипт, сохранённый service1, по его идентификатору"""
+    transcript_id = ref.get('id') if isinstance(ref, dict) else ref
+    if not transcript_id or not re.fullmatch(r'[0-9a-f]+', str(transcript_id)):
+        raise ValueError(f"Invalid transcript_ref: {ref}")
+    
+    path = os.path.join(TRANSCRIPTS_DIR, f"{transcript_id}.json.gz")
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        compact = json.load(f)
+    
+    segments = [
+        {'id': i, 'start': start, 'end': end, 'text': text}
+        for i, (start, end, text) in enumerate(zip(compact['start'], compact['end'], compact['segments']))
+    ]
+    return {
+        'text': compact['text'],
+        'language': compact.get('language'),
+        'segments': segments,
+        'words_path': compact.get('words_path')
+    }
+
+def fetch_source_video(job_id):
+    """Запросить у service1 видео для задачи, где было скачано только аудио"""
+    req = urllib.request.Request(
+        f"{SERVICE1_URL}/video",
+        data=json.dumps({'job_id': job_id}).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(req, timeout=7200) as resp:
+        result = json.loads(resp.read())
+    logging.info(f"Fetched video for job {job_id}: {result.get('video_path')}")
+    return result.get('video_path')
+
+def resolve_video_path(data):
+    """Путь к видео; если service1 скачал только аудио - докачиваем видео"""
+    video_path = data.get('video_path')
+    if video_path and os.path.exists(video_path):
+        return video_path
+    
+    job_id = data.get('job_id')
+    if not job_id and video_path:
+        # /data/<job_id>.mp4 - service1 оставляет рядом манифест с исходным URL
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        if os.path.exists(f"/data/{stem}.source.json"):
+            job_id = stem
+    if not job_id:
+        return video_path
+    
+    try:
+        return fetch_source_video(job_id)
+    except Exception as e:
+        logging.error(f"Error fetching video for job {job_id}: {e}")
+        return video_path
+
+def load_loudness_sidecar(video_path, data=None):
+    """Огибающая громкости, которую service1 сохранил рядом с медиафайлом.
+    
+    Файл отображается в память (mmap), ffmpeg не запускается. None, если
+    sidecar нет (например, видео скачано не через service1).
+    """
+    candidates = []
+    sidecar = (data or {}).get('audio_sidecar')
+    if isinstance(sidecar, dict):
+        candidates.append(sidecar.get('loudness_path'))
+    if video_path:
+        # /data/<job_id>.mp4 -> /data/<job_id>.loudness.npy (и для аудио-загрузки тоже)
+        candidates.append(os.path.splitext(video_path)[0] + '.loudness.npy')
+    
+    for path in candidates:
+        if path and os.path.exists(path):
+            try:
+                return np.load(path, mmap_mode='r')
+            except (OSError, ValueError) as e:
+                logging.warning(f"Cannot read loudness sidecar {path}: {e}")
+    return None
+
 def get_video_info(video_path):
     """Получить информацию о видео"""
     cmd = [
@@ -29,6 +119,8 @@ def get_video_info(video_path):
             width = int(video_stream['width'])
             height = int(video_stream['height'])
             duration = float(video_stream.get('duration', 0))
+            num, _, den = video_stream.get('r_frame_rate', '30/1').partition('/')
+            fps = float(num) / float(den or 1) if float(den or 1) else 30.0
             
             # Определяем ориентацию
             orientation = 'vertical' if height > width else 'horizontal'
@@ -37,77 +129,131 @@ def get_video_info(video_path):
                 'width': width,
                 'height': height,
                 'duration': duration,
+                'fps': fps,
                 'orientation': orientation
             }
     except Exception as e:
         logging.error(f"Error getting video info: {e}")
     
-    return {'width': 1920, 'height': 1080, 'duration': 0, 'orientation': 'horizontal'}
+    return {'width': 1920, 'height': 1080, 'duration': 0, 'fps': 30.0, 'orientation': 'horizontal'}
 
-def analyze_visual_activity(video_path, start_time, end_time):
-    """Анализ визуальной активности в видео"""
+def compute_motion_timeline(video_path, source_fps=30.0):
+    """Таймлайн визуальной активности за одно последовательное декодирование.
+    
+    ffmpeg сам прореживает кадры до MOTION_FPS и уменьшает их до
+    MOTION_FRAME_SIZE в оттенках серого; motion[i] - средняя разница между
+    кадрами i-1 и i (момент i / MOTION_FPS). Разница пересчитывается на один
+    кадр исходника, чтобы скор был в том же масштабе, что и раньше.
+    """
+    width, height = MOTION_FRAME_SIZE
+    frame_bytes = width * height
+    block_frames = 300  # 1 минута за одно чтение
+    proc = subprocess.Popen([
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-i', video_path,
+        '-an', '-vf', f'fps={MOTION_FPS},scale={width}:{height},format=gray',
+        '-f', 'rawvideo', 'pipe:1'
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    
+    motion = [np.zeros(1, np.float32)]
+    prev = None
     try:
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        
-        # Переходим к начальному кадру
-        cap.set(cv2.CAP_PROP_POS_FRAMES, int(start_time * fps))
-        
-        prev_frame = None
-        activity_scores = []
-        
-        current_time = start_time
-        while current_time < end_time:
-            ret, frame = cap.read()
-            if not ret:
+        while True:
+            raw = proc.stdout.read(block_frames * frame_bytes)
+            count = len(raw) // frame_bytes
+            if count == 0:
                 break
-                
-            # Конвертируем в grayscale для анализа
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            if prev_frame is not None:
-                # Считаем разницу между кадрами
-                diff = cv2.absdiff(prev_frame, gray)
-                activity_score = np.mean(diff)
-                activity_scores.append(activity_score)
-            
-            prev_frame = gray
-            current_time += 1/fps
-        
-        cap.release()
-        
-        # Возвращаем среднюю активность
-        return np.mean(activity_scores) if activity_scores else 0
-        
-    except Exception as e:
-        logging.error(f"Error analyzing visual activity: {e}")
-        return 0
+            frames = np.frombuffer(raw[:count * frame_bytes], np.uint8).reshape(count, height, width).astype(np.int16)
+            if prev is not None:
+                frames = np.concatenate((prev, frames))
+            diffs = np.abs(np.diff(frames, axis=0)).mean(axis=(1, 2))
+            motion.append(diffs.astype(np.float32))
+            prev = frames[-1:]
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    
+    timeline = np.concatenate(motion)
+    if prev is None:
+        return np.zeros(0, np.float32)
+    # Между сэмплами проходит source_fps / MOTION_FPS кадров исходника
+    return timeline / max(source_fps / MOTION_FPS, 1.0)
 
-def analyze_audio_energy(video_path, start_time, end_time):
-    """Анализ аудио энергии в сегменте"""
+def segment_visual_activity(motion, starts, ends):
+    """Средняя визуальная активность для всех отрезков сразу (префиксные суммы)"""
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.minimum(np.asarray(ends, dtype=np.float64), starts + MOTION_WINDOW_SECONDS)
+    if len(motion) < 2:
+        return np.zeros(len(starts))
+    
+    cumulative = np.concatenate(([0.0], np.cumsum(np.asarray(motion, dtype=np.float64))))
+    # motion[0] - не разница, а начало таймлайна
+    first = np.clip(np.floor(starts * MOTION_FPS).astype(np.int64) + 1, 1, len(motion))
+    last = np.clip(np.ceil(ends * MOTION_FPS).astype(np.int64) + 1, 1, len(motion))
+    count = last - first
+    
+    scores = np.zeros(len(starts))
+    valid = count > 0
+    scores[valid] = (cumulative[last[valid]] - cumulative[first[valid]]) / count[valid]
+    return scores
+
+def compute_loudness_timeline(video_path, sample_rate=16000):
+    """Огибающая громкости за один потоковый проход ffmpeg по аудиодорожке.
+    
+    Тот же формат, что и sidecar от service1: dBFS на каждые 100 мс. Аудио
+    читается блоками, поэтому память не зависит от длины видео.
+    """
+    window = int(LOUDNESS_WINDOW_SECONDS * sample_rate)
+    block_windows = 600  # 1 минута за одно чтение
+    proc = subprocess.Popen([
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-i', video_path,
+        '-vn', '-f', 's16le', '-ac', '1', '-ar', str(sample_rate),
+        'pipe:1'
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    
+    levels = []
     try:
-        cmd = [
-            'ffmpeg', '-i', video_path,
-            '-ss', str(start_time),
-            '-t', str(end_time - start_time),
-            '-af', 'volumedetect',
-            '-f', 'null', '-'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        output = result.stderr
-        
-        # Извлекаем среднюю громкость
-        for line in output.split('\n'):
-            if 'mean_volume:' in line:
-                volume = float(line.split('mean_volume:')[1].split('dB')[0].strip())
-                # Нормализуем (чем ближе к 0, тем громче)
-                return max(0, 100 + volume)
-                
-    except Exception as e:
-        logging.error(f"Error analyzing audio: {e}")
+        while True:
+            raw = proc.stdout.read(block_windows * window * 2)
+            if not raw:
+                break
+            samples = np.frombuffer(raw[:len(raw) // 2 * 2], np.int16).astype(np.float32) / 32768.0
+            count = -(-len(samples) // window)
+            samples = np.pad(samples, (0, count * window - len(samples)))
+            rms = np.sqrt(np.mean(samples.reshape(count, window) ** 2, axis=1))
+            levels.append(20 * np.log10(np.maximum(rms, 1e-5)))
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    
+    return np.concatenate(levels).astype(np.float32) if levels else np.zeros(0, np.float32)
+
+def segment_audio_energy(loudness, starts, ends):
+    """Аудио-скор для всех отрезков сразу, векторно.
     
-    return 0
+    Средняя мощность отрезка (как mean_volume у volumedetect) считается через
+    префиксные суммы мощности, так что стоимость не зависит от числа отрезков.
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(loudness) == 0:
+        return np.zeros(len(starts))
+    
+    power = 10 ** (np.asarray(loudness, dtype=np.float64) / 10)
+    cumulative = np.concatenate(([0.0], np.cumsum(power)))
+    
+    first = np.clip((starts / LOUDNESS_WINDOW_SECONDS).astype(np.int64), 0, len(power))
+    last = np.clip(np.ceil(ends / LOUDNESS_WINDOW_SECONDS).astype(np.int64), 0, len(power))
+    last = np.maximum(last, np.minimum(first + 1, len(power)))
+    count = last - first
+    
+    scores = np.zeros(len(starts))
+    valid = count > 0
+    mean_power = (cumulative[last[valid]] - cumulative[first[valid]]) / count[valid]
+    # Нормализуем (чем ближе к 0 dB, тем громче)
+    scores[valid] = np.maximum(0, 100 + 10 * np.log10(np.maximum(mean_power, 1e-12)))
+    return scores
 
 def analyze_transcript_segment(segment):
     """Анализ текста сегмента на вирусность"""
@@ -153,7 +299,7 @@ def analyze_transcript_segment(segment):
     
     return keyword_score + length_score + number_score + excitement_score
 
-def find_viral_moments(video_path, transcript, video_info):
+def find_viral_moments(video_path, transcript, video_info, loudness=None):
     """Находим самые вирусные моменты в видео"""
     segments = transcript.get('segments', [])
     duration = video_info['duration']
@@ -162,8 +308,28 @@ def find_viral_moments(video_path, transcript, video_info):
     
     viral_moments = []
     
+    # Движение по всему видео за одно декодирование, для видео любой длины
+    motion = np.zeros(0, np.float32)
+    if segments or duration >= 60:
+        try:
+            motion = compute_motion_timeline(video_path, video_info.get('fps') or 30.0)
+        except Exception as e:
+            logging.error(f"Error analyzing visual activity: {e}")
+    
+    # Громкость всего видео: sidecar от service1 или один проход ffmpeg
+    if loudness is None and (segments or duration >= 60):
+        try:
+            loudness = compute_loudness_timeline(video_path)
+        except Exception as e:
+            logging.error(f"Error analyzing audio: {e}")
+            loudness = np.zeros(0, np.float32)
+    
     # Если есть транскрипция, анализируем по сегментам
     if segments:
+        starts = [seg.get('start', 0) for seg in segments]
+        ends = [seg.get('end', seg.get('start', 0) + 1) for seg in segments]
+        audio_scores = segment_audio_energy(loudness, starts, ends)
+        visual_scores = segment_visual_activity(motion, starts, ends)
         for i, segment in enumerate(segments):
             start_time = segment.get('start', 0)
             end_time = segment.get('end', start_time + 1)
@@ -171,13 +337,11 @@ def find_viral_moments(video_path, transcript, video_info):
             # Базовый скор из анализа текста
             text_score = analyze_transcript_segment(segment)
             
-            # Анализ визуальной активности (опционально для производительности)
-            visual_score = 0
-            if duration < 300:  # Только для видео меньше 5 минут
-                visual_score = analyze_visual_activity(video_path, start_time, min(end_time, start_time + 5))
+            # Анализ визуальной активности (первые 5 секунд сегмента)
+            visual_score = float(visual_scores[i])
             
             # Анализ аудио энергии
-            audio_score = analyze_audio_energy(video_path, start_time, end_time)
+            audio_score = float(audio_scores[i])
             
             # Общий скор
             total_score = text_score + visual_score + audio_score
@@ -203,12 +367,16 @@ def find_viral_moments(video_path, transcript, video_info):
             }]
         else:
             # Для длинных видео без транскрипции - делим на части по 30 секунд
-            for i in range(0, int(duration), 30):
+            chunk_starts = list(range(0, int(duration), 30))
+            chunk_ends = [min(i + 30, duration) for i in chunk_starts]
+            audio_scores = segment_audio_energy(loudness, chunk_starts, chunk_ends)
+            visual_scores = segment_visual_activity(motion, chunk_starts, chunk_ends)
+            for i in chunk_starts:
                 start = i
                 end = min(i + 30, duration)
                 
-                visual_score = analyze_visual_activity(video_path, start, min(end, start + 5))
-                audio_score = analyze_audio_energy(video_path, start, end)
+                visual_score = float(visual_scores[i // 30])
+                audio_score = float(audio_scores[i // 30])
                 
                 viral_moments.append({
                     'start': start,
@@ -244,7 +412,7 @@ def merge_adjacent_moments(moments, max_gap=2):
     merged.append(current)
     return merged
 
-def create_smart_clips(video_path, transcript):
+def create_smart_clips(video_path, transcript, loudness=None):
     """Создаем умные клипы на основе анализа"""
     video_info = get_video_info(video_path)
     duration = video_info['duration']
@@ -299,7 +467,7 @@ def create_smart_clips(video_path, transcript):
         return clips
     
     # Для длинных видео - стандартная логика
-    viral_moments = find_viral_moments(video_path, transcript, video_info)
+    viral_moments = find_viral_moments(video_path, transcript, video_info, loudness)
     
     # Объединяем близкие моменты
     viral_moments = merge_adjacent_moments(viral_moments[:10])
@@ -406,16 +574,27 @@ def extract_clip(video_path, clip_info):
 def clip_video():
     try:
         data = request.json
-        video_path = data.get('video_path')
-        transcript = data.get('transcript', {})
+        video_path = resolve_video_path(data)
+        transcript = data.get('transcript') or {}
+        if data.get('transcript_ref'):
+            # service1 может передать ссылку на транскрипт вместо полного JSON
+            try:
+                transcript = load_transcript_ref(data['transcript_ref'])
+            except (ValueError, OSError) as e:
+                return jsonify({'error': f'Transcript not found: {e}'}), 400
         
         if not video_path or not os.path.exists(video_path):
             return jsonify({'error': 'Video file not found'}), 400
         
         logging.info(f"Processing video: {video_path}")
         
+        # Громкость уже посчитана service1 при загрузке - ffmpeg на сегмент не нужен
+        loudness = load_loudness_sidecar(video_path, data)
+        if loudness is None:
+            logging.info("No loudness sidecar, computing the loudness timeline in one ffmpeg pass")
+        
         # Анализируем и создаем клипы
-        clips = create_smart_clips(video_path, transcript)
+        clips = create_smart_clips(video_path, transcript, loudness)
         
         # Извлекаем клипы
         successful_clips = []
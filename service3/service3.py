@@ -8,10 +8,91 @@ import random
 from datetime import datetime
 import shutil
 import tempfile
+import gzip
+import re
+import mmap
+import struct
+import bisect
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
+TRANSCRIPTS_DIR = '/data/transcripts'
+
+def load_transcript_ref(ref):
+    """Загрузить транскрипт, сохранённый service1, по его идентификатору"""
+    transcript_id = ref.get('id') if isinstance(ref, dict) else ref
+    if not transcript_id or not re.fullmatch(r'[0-9a-f]+', str(transcript_id)):
+        raise ValueError(f"Invalid transcript_ref: {ref}")
+    
+    path = os.path.join(TRANSCRIPTS_DIR, f"{transcript_id}.json.gz")
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        compact = json.load(f)
+    
+    segments = [
+        {'id': i, 'start': start, 'end': end, 'text': text}
+        for i, (start, end, text) in enumerate(zip(compact['start'], compact['end'], compact['segments']))
+    ]
+    return {
+        'text': compact['text'],
+        'language': compact.get('language'),
+        'segments': segments,
+        'words_path': compact.get('words_path')
+    }
+
+WORD_SIDECAR_MAGIC = b'WRDS'
+
+def read_words(words_path, start, end):
+    """Слова из бинарного файла service1, пересекающие [start, end).
+    
+    Файл отображается в память, нужный диапазон ищется бинарным поиском
+    по массивам начала/конца слов, так что JSON не разбирается вообще.
+    """
+    with open(words_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, version, count, text_bytes = struct.unpack_from('<4sIII', mm, 0)
+        if magic != WORD_SIDECAR_MAGIC:
+            raise ValueError(f"Not a word timestamp file: {words_path}")
+        
+        # Колонки лежат в little endian - как и нативный порядок на наших серверах
+        view = memoryview(mm)
+        starts = view[16:16 + 4 * count].cast('f')
+        ends = view[16 + 4 * count:16 + 8 * count].cast('f')
+        offsets = view[16 + 8 * count:16 + 12 * count + 4].cast('I')
+        text = view[16 + 12 * count + 4:16 + 12 * count + 4 + text_bytes]
+        try:
+            lo = bisect.bisect_right(ends, start)
+            hi = bisect.bisect_left(starts, end)
+            return [
+                {
+                    'start': starts[i],
+                    'end': ends[i],
+                    'word': bytes(text[offsets[i]:offsets[i + 1]]).decode('utf-8')
+                }
+                for i in range(lo, max(lo, hi))
+            ]
+        finally:
+            for v in (starts, ends, offsets, text, view):
+                v.release()
+
+def group_words(words, max_words=4, max_gap=0.6):
+    """Собираем слова в короткие строки субтитров"""
+    lines = []
+    current = []
+    for word in words:
+        if current and (len(current) >= max_words or word['start'] - current[-1]['end'] > max_gap):
+            lines.append(current)
+            current = []
+        current.append(word)
+        if word['word'].strip().endswith(('.', '!', '?')):
+            lines.append(current)
+            current = []
+    if current:
+        lines.append(current)
+    return [
+        {'start': line[0]['start'], 'end': line[-1]['end'], 'text': ''.join(w['word'] for w in line).strip()}
+        for line in lines
+    ]
+
 def get_video_info(video_path):
     """Получить информацию о видео"""
     cmd = [
@@ -44,13 +125,18 @@ def get_video_info(video_path):
             'aspect_ratio': 16/9
         }
 
-def create_synchronized_subtitles(clip_info, transcript, output_path):
+def create_synchronized_subtitles(clip_info, transcript, output_path, words_path=None):
     """Создаем синхронизированные субтитры ТОЛЬКО для конкретного клипа"""
     clip_start = clip_info['start']
     clip_end = clip_info['end']
     
     segments = transcript.get('segments', []) if isinstance(transcript, dict) else []
     
+    # Если service1 сохранил тайминги слов - строим субтитры по словам
+    if words_path and os.path.exists(words_path):
+        segments = group_words(read_words(words_path, clip_start, clip_end))
+        logging.info(f"Using word-level timings from {words_path}")
+    
     # Фильтруем только те сегменты, которые попадают в временной диапазон клипа
     relevant_segments = []
     for segment in segments:
@@ -81,8 +167,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
     # Добавляем события субтитров
     for seg in relevant_segments:
         if seg['text']:
-            start_time = self._format_ass_time(seg['start'])
-            end_time = self._format_ass_time(seg['end'])
+            start_time = _format_ass_time(seg['start'])
+            end_time = _format_ass_time(seg['end'])
             
             # Разбиваем на слова для лучшей читаемости
             words = seg['text'].split()
@@ -110,7 +196,7 @@ def _format_ass_time(seconds):
     centisecs = int((seconds % 1) * 100)
     return f"{hours}:{minutes:02d}:{secs:02d}.{centisecs:02d}"
 
-def create_professional_edit(clip_path, clip_info, transcript):
+def create_professional_edit(clip_path, clip_info, transcript, words_path=None):
     """Создаем профессиональный монтаж без излишеств"""
     try:
         # Получаем информацию о видео
@@ -126,7 +212,7 @@ def create_professional_edit(clip_path, clip_info, transcript):
         subtitle_path = os.path.join(temp_dir, 'subtitles.ass')
         
         # Создаем синхронизированные субтитры
-        create_synchronized_subtitles(clip_info, transcript, subtitle_path)
+        create_synchronized_subtitles(clip_info, transcript, subtitle_path, words_path)
         
         # Строим команду FFmpeg
         video_filters = []
@@ -204,11 +290,20 @@ def edit_shorts():
     try:
         data = request.json
         clips = data.get('clips', [])
-        transcript = data.get('transcript', {})
+        transcript = data.get('transcript') or {}
         
         if not clips:
             return jsonify({'error': 'No clips provided'}), 400
         
+        if data.get('transcript_ref'):
+            # service1 может передать ссылку на транскрипт вместо полного JSON
+            try:
+                transcript = load_transcript_ref(data['transcript_ref'])
+            except (ValueError, OSError) as e:
+                return jsonify({'error': f'Transcript not found: {e}'}), 400
+        
+        words_path = data.get('words_path') or (transcript.get('words_path') if isinstance(transcript, dict) else None)
+        
         edited_clips = []
         
         for clip in clips:
@@ -220,7 +315,7 @@ def edit_shorts():
             
             try:
                 # Создаем профессиональную версию
-                result = create_professional_edit(clip_path, clip, transcript)
+                result = create_professional_edit(clip_path, clip, transcript, words_path)
                 
                 edited_clips.append({
                     'index': clip.get('index', 1),